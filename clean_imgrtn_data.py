@@ -1,134 +1,1420 @@
 import configparser
 import pandas as pd
 import os
-import subprocess
+import io
+import re
+import gzip
+import collections
+import json
+import hashlib
+import queue
+import threading
 import datetime as dt
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import as_completed
+from sql_redshift_qry import imgrtn_stg_col, imgrtn_stg_col_lst
+from sql_redshift_qry import imgrtn_src_col_lst, imgrtn_agg_stg_col_lst
+from run_report import RunReport, write_run_report
 
-def clean_imgrtn_data(imgrtn_src_dir, imgrtn_loc_dir):
+# pyreadstat can decode a subset of the SAS columns; without it the file is
+# decoded by pandas and projected right after each chunk is read
+try:
+    import pyreadstat
+except ImportError:
+    pyreadstat = None
+
+# zstandard is needed only when the cleaned CSV files are compressed with zstd
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# pyarrow is needed only when the cleaned data is written as Parquet files
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa, pq = None, None
+
+# approximate ratio between the in-memory size of a cleaned data frame row
+# (object strings plus the copies made while cleaning) and the SAS row length
+chunk_mem_factor = 8
+
+# SAS row length in bytes of a decoded source column
+sas_col_len = 8
+
+# data types of the cleaned immigration staging columns; codes are downcast to
+# nullable small integers and the low cardinality text to categories
+imgrtn_dtype_plan = {
+      'cicid': 'Int32'
+    , 'i94yr': 'Int16'
+    , 'i94mon': 'Int8'
+    , 'i94cit': 'Int16'
+    , 'i94res': 'Int16'
+    , 'i94port': 'category'
+    , 'i94mode': 'Int8'
+    , 'i94addr': 'category'
+    , 'i94bir': 'Int16'
+    , 'i94visa': 'Int8'
+    , 'count': 'Int16'
+    , 'visapost': 'category'
+    , 'occup': 'category'
+    , 'biryear': 'Int16'
+    , 'dtaddto': 'category'
+    , 'gender': 'category'
+    , 'airline': 'category'
+    , 'visatype': 'category'
+}
+
+# characters that are not matched by this pattern are kept in the data file;
+# it is the rule formerly applied with perl -pi -e s/[^a-zA-Z0-9,\.\-\n]+//g
+bad_char_pattern = r'[^a-zA-Z0-9,\.\-\n]+'
+
+# version of the cleaning rules; increment it whenever clean_imgrtn_chunk()
+# changes so that every source file is cleaned again
+clean_rules_ver = 1
+
+# number of partial pre-aggregated chunks combined into one at a time
+agg_combine_cnt = 16
+
+# compressed CSV file name suffix of each codec
+codec_f_nm_sfx = {'gzip': '.gz', 'zstd': '.zst'}
+
+# bytes of uncompressed CSV compressed as one gzip member by a worker thread
+gzip_block_size = 4 * 2**20
+
+# default compression settings: gzip level 6 in the writing thread
+dflt_codec_opt = {'codec': 'gzip', 'level': 6, 'threads': 0}
+
+# decoded SAS column cache file name suffix
+cache_f_nm_sfx = '.arrow'
+
+# manifest of the cleaned source files kept in the immigration location data
+# directory; the leading dot keeps it from being uploaded with the data files
+clean_manifest_f_nm = '.clean_manifest.json'
+
+def calc_chunk_rows(row_len, mem_budget_mb):
+    """
+    Determine the number of rows to read per data frame chunk so that a chunk
+    and the copies made while cleaning it stay within the memory budget.
+
+    Args:
+        (int) row_len - length in bytes of a row in the SAS data file
+        (int) mem_budget_mb - memory budget per chunk in megabytes
+
+    Returns:
+        (int) chunk_rows - number of rows to read per chunk
+    """
+
+    chunk_rows = (mem_budget_mb * 1024 * 1024) // (row_len * chunk_mem_factor)
+    return max(int(chunk_rows), 1)
+
+
+def read_imgrtn_chunks(src_path, mem_budget_mb):
+    """
+    Reads the staging source columns of an immigration SAS data file and yields
+    them as data frame chunks. The whole file is returned as one data frame when
+    no memory budget is set.
+
+    Args:
+        (str) src_path - immigration source data file path
+        (int) mem_budget_mb - memory budget per chunk in megabytes; 0 disables
+                              chunked reading
+
+    Yields:
+        (DataFrame) imgrtn_df - immigration data frame chunk
+    """
+
+    if pyreadstat is not None:
+        # decode only the source columns of the staging table
+        read_opt = {'usecols': imgrtn_src_col_lst, 'encoding': 'ISO-8859-1'
+                    , 'disable_datetime_conversion': True}
+        if not mem_budget_mb:
+            imgrtn_df, meta = pyreadstat.read_sas7bdat(src_path, **read_opt)
+            yield imgrtn_df[imgrtn_src_col_lst]
+            return
+
+        chunk_rows = calc_chunk_rows(sas_col_len * len(imgrtn_src_col_lst),
+                                     mem_budget_mb)
+
+        cur_dt = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        print('{}: reading {} rows per chunk from file: {}'. \
+                format(cur_dt, chunk_rows, src_path))
+        for imgrtn_df, meta in pyreadstat.read_file_in_chunks(
+                pyreadstat.read_sas7bdat, src_path, chunksize=chunk_rows,
+                **read_opt):
+            yield imgrtn_df[imgrtn_src_col_lst]
+        return
+
+    if not mem_budget_mb:
+        imgrtn_df = pd.read_sas(src_path, format='sas7bdat',
+                                encoding="ISO-8859-1")
+        yield imgrtn_df[imgrtn_src_col_lst]
+        return
+
+    reader = pd.read_sas(src_path, format='sas7bdat', encoding="ISO-8859-1",
+                         iterator=True)
+    try:
+        chunk_rows = calc_chunk_rows(reader.row_length, mem_budget_mb)
+
+        cur_dt = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        print('{}: reading {} rows per chunk from file: {}'. \
+                format(cur_dt, chunk_rows, src_path))
+        while True:
+            imgrtn_df = reader.read(chunk_rows)
+            if imgrtn_df is None or imgrtn_df.empty:
+                break
+            yield imgrtn_df[imgrtn_src_col_lst]
+    finally:
+        reader.close()
+
+
+def get_cache_path(cache_dir, src_sha256):
+    """
+    Compose the path of the decoded column cache file of a source file. The
+    name combines the source content hash with a hash of the decoded source
+    columns, so that a change in either one misses the cache.
+
+    Args:
+        (str) cache_dir - decoded SAS column cache directory
+        (str) src_sha256 - SHA-256 hash of the source file content
+
+    Returns:
+        (str) cache_path - cache file path
+    """
+
+    col_hash = hashlib.sha256(','.join(imgrtn_src_col_lst).encode('utf-8')). \
+        hexdigest()[:8]
+    return '{}/{}_{}{}'.format(cache_dir, src_sha256[:32], col_hash,
+                               cache_f_nm_sfx)
+
+
+def get_cache_schema():
+    """
+    Compose the Arrow schema of the decoded SAS source columns; SAS numeric
+    columns are decoded as doubles and character columns as strings.
+
+    Returns:
+        (Schema) schema - pyarrow schema of the decoded source columns
+    """
+
+    return pa.schema([(src_col,
+                       pa.string() if data_type == 'TEXT' else pa.float64())
+                      for stg_col, src_col, data_type in imgrtn_stg_col])
+
+
+def read_cache_chunks(cache_path):
+    """
+    Reads the decoded source columns from a memory-mapped cache file and yields
+    them as data frame chunks, one per record batch written. Each column is
+    kept in its own block: numeric columns without missing values are read-only
+    views of the mapped file, while the other numeric columns and the string
+    columns are converted into new arrays.
+
+    Args:
+        (str) cache_path - cache file path
+
+    Yields:
+        (DataFrame) imgrtn_df - immigration data frame chunk
+    """
+
+    # mark the entry as recently used so that it is evicted last
+    os.utime(cache_path)
+
+    cur_dt = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print('{}: reading decoded columns from cache file: {}'. \
+            format(cur_dt, cache_path))
+    with pa.memory_map(cache_path, 'r') as cache_f:
+        reader = pa.ipc.open_file(cache_f)
+        for batch_nbr in range(reader.num_record_batches):
+            yield reader.get_batch(batch_nbr).to_pandas(split_blocks=True,
+                                                        self_destruct=True)
+
+
+def cache_imgrtn_chunks(chunk_iter, cache_path):
+    """
+    Passes the decoded data frame chunks through, writing a copy of each one to
+    the cache file. The cache file only appears once every chunk is written.
+
+    Args:
+        (iterator) chunk_iter - decoded immigration data frame chunks
+        (str) cache_path - cache file path
+
+    Yields:
+        (DataFrame) imgrtn_df - immigration data frame chunk
+    """
+
+    tmp_path = cache_path + '.tmp'
+    schema = get_cache_schema()
+    writer = pa.ipc.new_file(tmp_path, schema)
+    try:
+        for imgrtn_df in chunk_iter:
+            writer.write_table(pa.Table.from_pandas(imgrtn_df, schema=schema,
+                                                    preserve_index=False))
+            yield imgrtn_df
+        writer.close()
+    except BaseException:
+        writer.close()
+        os.remove(tmp_path)
+        raise
+
+    os.replace(tmp_path, cache_path)
+
+
+def prefetch_chunks(chunk_iter, chunk_q_size):
+    """
+    Reads the data frame chunks ahead in a background thread so that decoding
+    the next chunk overlaps cleaning and compressing the current one. At most
+    chunk_q_size decoded chunks wait in the queue, bounding the memory used.
+
+    Args:
+        (iterator) chunk_iter - decoded immigration data frame chunks
+        (int) chunk_q_size - maximum number of chunks read ahead
+
+    Yields:
+        (DataFrame) imgrtn_df - immigration data frame chunk
+    """
+
+    chunk_q = queue.Queue(maxsize=chunk_q_size)
+    stop_evt = threading.Event()
+    end_mark = object()
+
+    def put_chunk(item):
+        # wait for room in the queue unless the consumer has stopped
+        while not stop_evt.is_set():
+            try:
+                chunk_q.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read_chunks():
+        item = end_mark
+        try:
+            for imgrtn_df in chunk_iter:
+                if not put_chunk(imgrtn_df):
+                    break
+        except BaseException as err:
+            item = err
+        finally:
+            chunk_iter.close()
+        put_chunk(item)
+
+    reader = threading.Thread(target=read_chunks, daemon=True)
+    reader.start()
+    try:
+        while True:
+            item = chunk_q.get()
+            if item is end_mark:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop_evt.set()
+        reader.join()
+
+
+def evict_cache(cache_dir, cache_max_mb, cur_sha256_lst):
+    """
+    Removes decoded column cache files until the cache fits in its size limit.
+    Entries of source files that are no longer current are removed first,
+    then the least recently used ones.
+
+    Args:
+        (str) cache_dir - decoded SAS column cache directory
+        (int) cache_max_mb - cache size limit in megabytes; 0 is no limit
+        (list) cur_sha256_lst - SHA-256 hashes of the current source files
+    """
+
+    if not cache_max_mb:
+        return
+
+    cur_key_set = {src_sha256[:32] for src_sha256 in cur_sha256_lst}
+    cache_f_lst = []
+    for f_nm in os.listdir(cache_dir):
+        if f_nm.endswith(cache_f_nm_sfx):
+            f_stat = os.stat(cache_dir + '/' + f_nm)
+            is_cur = f_nm.split('_')[0] in cur_key_set
+            cache_f_lst.append((is_cur, f_stat.st_mtime, f_stat.st_size, f_nm))
+
+    cache_sz = sum(f_sz for is_cur, mtime, f_sz, f_nm in cache_f_lst)
+    for is_cur, mtime, f_sz, f_nm in sorted(cache_f_lst):
+        if cache_sz <= cache_max_mb * 1024 * 1024:
+            break
+
+        cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        print('{}: evicting {} cache file: {}'. \
+                format(cur_ts, 'current' if is_cur else 'stale', f_nm))
+        os.remove(cache_dir + '/' + f_nm)
+        cache_sz -= f_sz
+
+
+def clean_imgrtn_chunk(imgrtn_df):
+    """
+    Cleans an immigration data frame or a chunk of it holding the staging
+    source columns, renaming them to the staging table columns.
+
+    Args:
+        (DataFrame) imgrtn_df - immigration data frame read from source file
+
+    Returns:
+        (DataFrame) imgrtn_df - cleaned immigration data frame
+    """
+
+    # replace NULL values in i94mode with 9 (Not reported)
+    imgrtn_df["i94mode"] = imgrtn_df["i94mode"].fillna(9)
+
+    #replace D/S values in dtaddto with 12319999
+    imgrtn_df["dtaddto"] = imgrtn_df["dtaddto"].replace({"D/S": '12319999'})
+
+    # name the columns after the staging table columns
+    imgrtn_df.columns = imgrtn_stg_col_lst
+
+    # convert columns to compact data types before the date conversion
+    imgrtn_df = imgrtn_df.astype(imgrtn_dtype_plan)
+
+    # convert date integer values to dates
+    imgrtn_df['arrvl_dt'] = \
+        pd.to_timedelta(imgrtn_df['arrvl_dt'], unit='d') + \
+        pd.Timestamp(1960, 1, 1)
+
+    imgrtn_df['dep_dt'] = \
+        pd.to_timedelta(imgrtn_df['dep_dt'], unit='d') + \
+        pd.Timestamp(1960, 1, 1)
+
+    return imgrtn_df
+
+
+def calc_df_mem_mb(imgrtn_df):
+    """
+    Calculate the memory footprint of a data frame including the contents of
+    its object columns.
+
+    Args:
+        (DataFrame) imgrtn_df - immigration data frame
+
+    Returns:
+        (float) mem_mb - memory footprint in megabytes
+    """
+
+    return imgrtn_df.memory_usage(index=True, deep=True).sum() / (1024 * 1024)
+
+
+def get_imgrtn_parquet_schema():
+    """
+    Compose the Parquet schema of the cleaned immigration data from the data
+    types of the immigration staging table columns.
+
+    Returns:
+        (Schema) schema - pyarrow schema of the cleaned immigration data
+    """
+
+    arrow_type = {'SMALLINT': pa.int16(), 'INT': pa.int32()
+                  , 'DATE': pa.date32(), 'TEXT': pa.string()}
+    return pa.schema([(stg_col, arrow_type[data_type.split()[0]])
+                      for stg_col, src_col, data_type in imgrtn_stg_col])
+
+
+class ParallelGzipWriter(io.RawIOBase):
+    """
+    Writable binary file compressing its content on a pool of threads. The
+    content is cut into blocks and each block is compressed into its own gzip
+    member, so that several cores share one file; concatenated members form a
+    valid gzip file. The compressed members are written in order and at most
+    two per thread are held in memory.
+    """
+
+    def __init__(self, dest, level, threads):
+        """
+        Args:
+            (str) dest - output file path, or a writable binary file object,
+                         which is left open when the writer is closed
+            (int) level - gzip compression level
+            (int) threads - number of compression threads
+        """
+
+        super().__init__()
+        if isinstance(dest, str):
+            self.dest_f, self.own_dest_f = open(dest, 'wb'), True
+        else:
+            self.dest_f, self.own_dest_f = dest, False
+        self.level = level
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        self.max_pending = threads * 2
+        self.pending = collections.deque()
+        self.block_cnt = 0
+        self.buf = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError('I/O operation on closed file')
+
+        data_len = memoryview(data).nbytes
+        self.buf += data
+        while len(self.buf) >= gzip_block_size:
+            self.submit_block(bytes(self.buf[:gzip_block_size]))
+            del self.buf[:gzip_block_size]
+
+        return data_len
+
+    def submit_block(self, block):
+        # zlib releases the GIL, so the blocks are compressed in parallel
+        self.pending.append(self.executor.submit(gzip.compress, block,
+                                                 self.level, mtime=0))
+        self.block_cnt += 1
+        while len(self.pending) > self.max_pending:
+            self.dest_f.write(self.pending.popleft().result())
+
+    def close(self):
+        if self.closed:
+            return
+
+        try:
+            # an empty file is still written as one empty gzip member
+            if self.buf or self.block_cnt == 0:
+                self.submit_block(bytes(self.buf))
+                self.buf = bytearray()
+            while self.pending:
+                self.dest_f.write(self.pending.popleft().result())
+        finally:
+            self.executor.shutdown(cancel_futures=True)
+            if self.own_dest_f:
+                self.dest_f.close()
+            super().close()
+
+
+def open_compressed_file(dest_path, codec_opt):
+    """
+    Open a binary file compressing the data written to it in-process, with
+    gzip or zstd, on one or more threads.
+
+    Args:
+        (str) dest_path - output file path, or a writable binary file object
+        (dict) codec_opt - codec, level and number of compression threads
+
+    Returns:
+        (file) comp_f - writable binary file
+    """
+
+    level, threads = codec_opt['level'], codec_opt['threads']
+    if codec_opt['codec'] == 'zstd':
+        if zstandard is None:
+            raise ValueError('zstandard is required to write zstd files')
+        cctx = zstandard.ZstdCompressor(level=level, threads=threads)
+        if isinstance(dest_path, str):
+            return cctx.stream_writer(open(dest_path, 'wb'), closefd=True)
+        return cctx.stream_writer(dest_path, closefd=False)
+
+    if threads > 1:
+        return ParallelGzipWriter(dest_path, level, threads)
+
+    if isinstance(dest_path, str):
+        return gzip.open(dest_path, 'wb', compresslevel=level)
+    return gzip.GzipFile(fileobj=dest_path, mode='wb', compresslevel=level)
+
+
+def open_clean_file(dest_path, out_fmt, codec_opt=None):
+    """
+    Open the output file of the cleaned immigration data.
+
+    Args:
+        (str) dest_path - output file path, or a writable file object
+        (str) out_fmt - output file format: csv or parquet
+        (dict) codec_opt - compression of the CSV file; gzip level 6 in the
+                           writing thread when not given
+
+    Returns:
+        (file) out_f - compressed text file or Parquet writer
+    """
+
+    if out_fmt == 'parquet':
+        if pq is None:
+            raise ValueError('pyarrow is required to write Parquet files')
+        return pq.ParquetWriter(dest_path, get_imgrtn_parquet_schema(),
+                                compression='snappy')
+
+    comp_f = open_compressed_file(dest_path, codec_opt or dflt_codec_opt)
+    return io.TextIOWrapper(comp_f, encoding='utf-8', newline='')
+
+
+def write_clean_parquet(out_f, imgrtn_df):
+    """
+    Writes a cleaned data frame chunk as a row group of the Parquet file.
+
+    Args:
+        (ParquetWriter) out_f - open Parquet writer
+        (DataFrame) imgrtn_df - cleaned immigration data frame chunk
+    """
+
+    out_f.write_table(pa.Table.from_pandas(imgrtn_df, schema=out_f.schema,
+                                           preserve_index=False))
+
+
+def write_clean_csv(out_f, imgrtn_df, header, bad_char_re):
+    """
+    Serializes a cleaned data frame chunk to CSV, removes the bad characters
+    from the CSV text and writes it to the open compressed output file.
+
+    Args:
+        (file) out_f - compressed output file opened in text mode
+        (DataFrame) imgrtn_df - cleaned immigration data frame chunk
+        (bool) header - write the column names before the rows
+        (Pattern) bad_char_re - compiled pattern of characters to remove
+    """
+
+    csv_txt = imgrtn_df.to_csv(index=False, header=header)
+    out_f.write(bad_char_re.sub('', csv_txt))
+
+
+def agg_imgrtn_chunk(imgrtn_df):
+    """
+    Sums the immigrant count of a cleaned data frame chunk by the keys of the
+    fact table grain: arrival month, citizenship, residence, port of entry,
+    transportation mode, destination state and visa category.
+
+    Args:
+        (DataFrame) imgrtn_df - cleaned immigration data frame chunk
+
+    Returns:
+        (DataFrame) agg_df - pre-aggregated immigration data frame
+    """
+
+    arrvl_dt = imgrtn_df['arrvl_dt'].dt
+    agg_df = imgrtn_df.assign(
+        arrvl_yr_mnth=(arrvl_dt.year * 100 + arrvl_dt.month).astype('Int32'),
+        count=imgrtn_df['count'].astype('Int64'))
+
+    return agg_df.groupby(imgrtn_agg_stg_col_lst[:-1], dropna=False,
+                          observed=True, as_index=False)['count'].sum()
+
+
+def combine_imgrtn_agg(agg_df_lst):
+    """
+    Combines partial pre-aggregated data frames into one, summing the immigrant
+    count of the keys found in more than one of them.
+
+    Args:
+        (list) agg_df_lst - pre-aggregated immigration data frames
+
+    Returns:
+        (DataFrame) agg_df - combined pre-aggregated immigration data frame
+    """
+
+    agg_df = pd.concat(agg_df_lst, ignore_index=True)
+    return agg_df.groupby(imgrtn_agg_stg_col_lst[:-1], dropna=False,
+                          observed=True, as_index=False)['count'].sum()
+
+
+def write_clean_chunk(out_f, imgrtn_df, out_fmt, header, bad_char_re):
+    """
+    Writes a cleaned data frame chunk to an open CSV or Parquet output file.
+    CSV chunks have bad characters removed and are compressed while written;
+    Parquet files hold typed UTF-8 values that need no scrub.
+
+    Args:
+        (file) out_f - output file returned by open_clean_file()
+        (DataFrame) imgrtn_df - cleaned immigration data frame chunk
+        (str) out_fmt - output file format: csv or parquet
+        (bool) header - write the CSV column names before the rows
+        (Pattern) bad_char_re - compiled pattern of characters to remove
+    """
+
+    if out_fmt == 'parquet':
+        write_clean_parquet(out_f, imgrtn_df)
+    else:
+        write_clean_csv(out_f, imgrtn_df, header, bad_char_re)
+
+
+def get_imgrtn_row_cnt(src_path):
+    """
+    Obtain the number of rows in an immigration SAS data file from its header
+    without decoding the rows.
+
+    Args:
+        (str) src_path - immigration source data file path
+
+    Returns:
+        (int) row_cnt - number of rows in the file
+    """
+
+    if pyreadstat is not None:
+        imgrtn_df, meta = pyreadstat.read_sas7bdat(src_path,
+                                                   metadataonly=True)
+        return meta.number_rows
+
+    reader = pd.read_sas(src_path, format='sas7bdat', encoding="ISO-8859-1",
+                         iterator=True)
+    try:
+        return reader.row_count
+    finally:
+        reader.close()
+
+
+def get_clean_f_nm_sfx(out_fmt, codec='gzip'):
+    """
+    Return the file name suffix of the cleaned immigration data files.
+
+    Args:
+        (str) out_fmt - output file format: csv or parquet
+        (str) codec - compression codec of CSV files: gzip or zstd
+
+    Returns:
+        (str) f_nm_sfx - file name suffix
+    """
+
+    if out_fmt == 'parquet':
+        return '.parquet'
+
+    return '.csv' + codec_f_nm_sfx[codec]
+
+
+def remove_clean_files(imgrtn_loc_dir, f_nm_prfx):
+    """
+    Remove the cleaned data file or file parts written by an earlier run for a
+    source file, so that stale parts are not uploaded with the new ones.
+
+    Args:
+        (str) imgrtn_loc_dir - immigration location data directory
+        (str) f_nm_prfx - source file name without extension
+    """
+
+    for f_nm in os.listdir(imgrtn_loc_dir):
+        if f_nm.startswith(f_nm_prfx + '.'):
+            os.remove(imgrtn_loc_dir + '/' + f_nm)
+
+
+def open_clean_dest(dest_path, out_fmt, s3, codec_opt=None):
+    """
+    Open the output file of the cleaned immigration data on the local disk, or
+    streamed straight to AWS S3 when the path is an S3 URL.
+
+    Args:
+        (str) dest_path - output file path or AWS S3 URL
+        (str) out_fmt - output file format: csv or parquet
+        (dict) s3 - AWS S3 client and part size used for S3 URLs
+        (dict) codec_opt - compression of the CSV file
+
+    Returns:
+        (tuple) out_f, dest_f - output file returned by open_clean_file() and
+                                the S3 object writer (None for local files)
+    """
+
+    if not dest_path.startswith('s3://'):
+        return open_clean_file(dest_path, out_fmt, codec_opt), None
+
+    from upload_file_to_aws import S3MultipartWriter, split_s3_url
+    s3_bucket_nm, s3_key = split_s3_url(dest_path)
+    dest_f = S3MultipartWriter(s3['client'], s3_bucket_nm, s3_key,
+                               s3['part_size'])
+    return open_clean_file(dest_f, out_fmt, codec_opt), dest_f
+
+
+def close_clean_dest(out_f, dest_f, abort=False):
+    """
+    Close an output file opened by open_clean_dest(). The S3 object is only
+    created when the file is closed without abort.
+
+    Args:
+        (file) out_f - output file returned by open_clean_file()
+        (S3MultipartWriter) dest_f - S3 object writer or None
+        (bool) abort - discard the S3 object
+    """
+
+    try:
+        out_f.close()
+    except BaseException:
+        if dest_f is not None:
+            dest_f.abort()
+        raise
+
+    if dest_f is None:
+        return
+
+    if abort:
+        dest_f.abort()
+    else:
+        dest_f.close()
+
+
+def remove_clean_dest(imgrtn_loc_dir, f_nm_prfx, s3):
+    """
+    Remove the cleaned data files of a source file from the local directory,
+    or from the AWS S3 bucket when the files are streamed to S3. The objects
+    are removed in both key layouts, since an earlier run may have used the
+    other one.
+
+    Args:
+        (str) imgrtn_loc_dir - immigration location data directory
+        (str) f_nm_prfx - source file name without extension
+        (dict) s3 - AWS S3 client and bucket name; None for local files
+    """
+
+    if s3 is None:
+        remove_clean_files(imgrtn_loc_dir, f_nm_prfx)
+        return
+
+    from upload_file_to_aws import delete_s3_objects, get_s3_key
+    for key_layout in ['flat', 'partitioned']:
+        delete_s3_objects(s3['client'], s3['s3_bucket_nm'],
+                          get_s3_key(f_nm_prfx, key_layout) + '.')
+
+
+def put_clean_file(part_q, dest_path):
+    """
+    Hands a completed output file over to the next pipeline stage, if any.
+    Files streamed to AWS S3 are already uploaded and are not queued.
+
+    Args:
+        (Queue) part_q - queue receiving the completed output file paths
+        (str) dest_path - completed output file path
+    """
+
+    if part_q is None or dest_path.startswith('s3://'):
+        return
+
+    cur_dt = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print('{}: queueing file: {} for upload'.format(cur_dt, dest_path))
+    part_q.put(dest_path)
+
+
+def clean_imgrtn_file(imgrtn_src_dir, src_f_nm, imgrtn_loc_dir, clean_opt,
+                      src_sha256=None, part_q=None):
+    """
+    Reads and cleans an immigration data file chunk by chunk. Each cleaned
+    chunk is written to the compressed CSV output file in a single pass,
+    removing bad characters as it is serialized, or to a Parquet output file.
+    When more than one part is requested, the rows are split into roughly equal
+    output file parts so that Redshift can load them in parallel. In
+    pre-aggregation mode the chunks are summed to the fact table grain and
+    written to a single compressed CSV file instead. When a cache directory is
+    set, the decoded columns are read from, or saved to, the cache file of the
+    source content hash.
+    When an S3 output is set, the compressed bytes are streamed straight into
+    S3 multipart uploads and no output file is written to the local disk.
+    When a part queue is given, the path of each output file is put on it as
+    soon as the file is complete, waiting while the queue is full.
+
+    Args:
+        (str) imgrtn_src_dir - immigration source data directory
+        (str) src_f_nm - immigration source data file name
+        (str) imgrtn_loc_dir - immigration location data directory
+        (dict) clean_opt - cleaning options returned by get_clean_opt()
+        (str) src_sha256 - SHA-256 hash of the source file content; required
+                           to use the decoded column cache
+        (Queue) part_q - queue receiving the completed output file paths
+
+    Returns:
+        (list) dest_path_lst - paths or S3 URLs of the cleaned output files
+        (int) row_cnt - number of source rows cleaned
+    """
+
+    # assemble source data file path
+    src_path = imgrtn_src_dir + '/' + src_f_nm
+
+    # determine path prefix of the compressed CSV or Parquet output files
+    f_nm_prfx = src_f_nm.split(".")[0]
+    out_fmt = clean_opt['out_fmt']
+    codec_opt = clean_opt['codec_opt']
+    f_nm_sfx = get_clean_f_nm_sfx(out_fmt, codec_opt['codec'])
+    bad_char_re = re.compile(clean_opt['bad_char_ptrn'])
+
+    # stream the output files to AWS S3 through the worker's own client
+    s3_out = clean_opt['s3_out']
+    if s3_out:
+        from upload_file_to_aws import open_s3_client, get_s3_key
+        s3_key_prfx = get_s3_key(f_nm_prfx, s3_out['upload_opt']['key_layout'])
+        s3 = {'client': open_s3_client(s3_out['upload_opt'])
+              , 's3_bucket_nm': s3_out['s3_bucket_nm']
+              , 'part_size': s3_out['upload_opt']['multipart_chunk_mb'] * 2**20}
+        dest_prfx = 's3://' + s3_out['s3_bucket_nm'] + '/' + s3_key_prfx
+    else:
+        s3 = None
+        dest_prfx = imgrtn_loc_dir + '/' + f_nm_prfx
+    remove_clean_dest(imgrtn_loc_dir, f_nm_prfx, s3)
+
+    # determine the number of rows written to each output file part
+    part_cnt = clean_opt['part_cnt']
+    if part_cnt > 1 and not clean_opt['pre_agg']:
+        row_cnt = get_imgrtn_row_cnt(src_path)
+        part_rows = max(-(-row_cnt // part_cnt), 1)
+    else:
+        part_rows = None
+
+    cur_dt = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print('{}: reading file: {} into data frame'.format(cur_dt, src_path))
+
+    # read the decoded columns from the cache, or save them to it
+    chunk_iter = read_imgrtn_chunks(src_path, clean_opt['mem_budget_mb'])
+    if clean_opt['cache_dir'] and src_sha256:
+        cache_path = get_cache_path(clean_opt['cache_dir'], src_sha256)
+        if os.path.exists(cache_path):
+            chunk_iter = read_cache_chunks(cache_path)
+        else:
+            chunk_iter = cache_imgrtn_chunks(chunk_iter, cache_path)
+    if clean_opt['chunk_q_size'] > 0:
+        chunk_iter = prefetch_chunks(chunk_iter, clean_opt['chunk_q_size'])
+
+    dest_path_lst = []
+    out_f, dest_f, part_row_cnt = None, None, 0
+    agg_df_lst = []
+    try:
+        chunk_nbr, row_cnt = 0, 0
+        raw_mem_mb, clean_mem_mb = 0.0, 0.0
+        for imgrtn_df in chunk_iter:
+            chunk_nbr += 1
+            row_cnt += len(imgrtn_df)
+
+            # cleaning data frame columns
+            cur_dt = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            print('{}: cleaning data frame chunk: {} of {} rows'. \
+                    format(cur_dt, chunk_nbr, len(imgrtn_df)))
+            raw_mem_mb += calc_df_mem_mb(imgrtn_df)
+            imgrtn_df = clean_imgrtn_chunk(imgrtn_df)
+            clean_mem_mb += calc_df_mem_mb(imgrtn_df)
+
+            # sum the chunk to the fact grain, combining the partial sums
+            # from time to time to bound their memory
+            if clean_opt['pre_agg']:
+                agg_df_lst.append(agg_imgrtn_chunk(imgrtn_df))
+                if len(agg_df_lst) >= agg_combine_cnt:
+                    agg_df_lst = [combine_imgrtn_agg(agg_df_lst)]
+                continue
+
+            # write the chunk rows, moving on to the next file part when the
+            # current part holds its share of the rows
+            row_pos = 0
+            while row_pos < len(imgrtn_df):
+                if out_f is None or part_row_cnt == part_rows:
+                    if out_f is not None:
+                        close_clean_dest(out_f, dest_f)
+                        put_clean_file(part_q, dest_path)
+
+                    if part_rows is None:
+                        dest_path = dest_prfx + f_nm_sfx
+                    else:
+                        dest_path = '{}.part-{:04d}{}'. \
+                            format(dest_prfx, len(dest_path_lst), f_nm_sfx)
+
+                    dest_path_lst.append(dest_path)
+                    out_f, dest_f = open_clean_dest(dest_path, out_fmt, s3,
+                                                    codec_opt)
+                    part_row_cnt = 0
+
+                if part_rows is None:
+                    write_rows = len(imgrtn_df) - row_pos
+                else:
+                    write_rows = min(part_rows - part_row_cnt,
+                                     len(imgrtn_df) - row_pos)
+
+                cur_dt = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                print('{}: writing {} rows of data frame chunk: {} to file: {}'.
+                        format(cur_dt, write_rows, chunk_nbr, dest_path))
+                write_clean_chunk(out_f,
+                                  imgrtn_df.iloc[row_pos:row_pos + write_rows],
+                                  out_fmt, part_row_cnt == 0, bad_char_re)
+                row_pos += write_rows
+                part_row_cnt += write_rows
+
+            #clean data frame
+            imgrtn_df = imgrtn_df.iloc[0:0]
+
+        if out_f is not None:
+            close_clean_dest(out_f, dest_f)
+            put_clean_file(part_q, dest_path)
+            out_f = None
+
+        if clean_opt['pre_agg'] and agg_df_lst:
+            agg_df = combine_imgrtn_agg(agg_df_lst)
+            dest_path = dest_prfx + get_clean_f_nm_sfx('csv',
+                                                       codec_opt['codec'])
+
+            cur_dt = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            print('{}: writing {} pre-aggregated rows to file: {}'.
+                    format(cur_dt, len(agg_df), dest_path))
+            dest_path_lst.append(dest_path)
+            out_f, dest_f = open_clean_dest(dest_path, 'csv', s3, codec_opt)
+            write_clean_csv(out_f, agg_df[imgrtn_agg_stg_col_lst], True,
+                            bad_char_re)
+            close_clean_dest(out_f, dest_f)
+            put_clean_file(part_q, dest_path)
+    except BaseException:
+        # do not leave partial data or cache files behind
+        chunk_iter.close()
+        if out_f is not None:
+            close_clean_dest(out_f, dest_f, abort=True)
+        remove_clean_dest(imgrtn_loc_dir, f_nm_prfx, s3)
+        raise
+
+    cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print('{}: data frame memory footprint of file: {}: {:.1f} MB decoded, '
+          '{:.1f} MB cleaned'.format(cur_ts, src_f_nm, raw_mem_mb,
+                                     clean_mem_mb))
+    print('{}: cleaned data file: {} into {} file(s) successfully'. \
+            format(cur_ts, src_f_nm, len(dest_path_lst)))
+    return dest_path_lst, row_cnt
+
+
+def get_cluster_slice_cnt(config):
+    """
+    Obtain the number of slices of the Redshift cluster, which is the number
+    of files the cluster can load in parallel.
+
+    Args:
+        (ConfigParser) config - parsed data warehouse configuration file
+
+    Returns:
+        (int) slice_cnt - number of cluster slices
+    """
+
+    # imported here so that cleaning does not require a database driver
+    # unless the slice count is taken from the cluster
+    from db_access import open_db_pool
+
+    db_pool = open_db_pool(config, 1)
+    if db_pool is None:
+        raise ValueError('unable to obtain the cluster slice count')
+
+    try:
+        return db_pool.fetchall('SELECT COUNT(*) FROM stv_slices;',
+                                'retrieving the cluster slice count')[0][0]
+    finally:
+        db_pool.closeall()
+
+
+def calc_file_sha256(f_path):
+    """
+    Calculate the SHA-256 hash of the content of a file, reading it in blocks.
+
+    Args:
+        (str) f_path - file path
+
+    Returns:
+        (str) sha256 - hexadecimal SHA-256 hash of the file content
+    """
+
+    f_hash = hashlib.sha256()
+    with open(f_path, 'rb') as in_f:
+        for blk in iter(lambda: in_f.read(8 * 1024 * 1024), b''):
+            f_hash.update(blk)
+    return f_hash.hexdigest()
+
+
+def get_clean_rules_ver(clean_opt):
+    """
+    Compose the version of the cleaning rules from the rules version number and
+    the options that change the content or layout of the cleaned files.
+
+    Args:
+        (dict) clean_opt - cleaning options returned by get_clean_opt()
+
+    Returns:
+        (str) rules_ver - cleaning rules version
+    """
+
+    rules = {'ver': clean_rules_ver, 'bad_char_ptrn': clean_opt['bad_char_ptrn']
+             , 'out_fmt': clean_opt['out_fmt']
+             , 'part_cnt': clean_opt['part_cnt']
+             , 'pre_agg': clean_opt['pre_agg']}
+
+    # files streamed to AWS S3 are not available locally and vice versa
+    if clean_opt['s3_out']:
+        rules['out_target'] = 's3'
+
+    # zstd files have other names than the gzip files
+    if clean_opt['codec_opt']['codec'] != 'gzip':
+        rules['codec'] = clean_opt['codec_opt']['codec']
+    return hashlib.sha256(json.dumps(rules, sort_keys=True).encode('utf-8')). \
+        hexdigest()[:16]
+
+
+def read_clean_manifest(imgrtn_loc_dir):
+    """
+    Read the manifest recording the fingerprint of the source files cleaned
+    into the immigration location data directory.
+
+    Args:
+        (str) imgrtn_loc_dir - immigration location data directory
+
+    Returns:
+        (dict) manifest - manifest entry per source file name
+    """
+
+    manifest_path = imgrtn_loc_dir + '/' + clean_manifest_f_nm
+    if not os.path.exists(manifest_path):
+        return {}
+
+    with open(manifest_path) as in_f:
+        return json.load(in_f)
+
+
+def write_clean_manifest(imgrtn_loc_dir, manifest):
+    """
+    Write the manifest of cleaned source files, replacing the previous one only
+    once the new one is completely written.
+
+    Args:
+        (str) imgrtn_loc_dir - immigration location data directory
+        (dict) manifest - manifest entry per source file name
+    """
+
+    manifest_path = imgrtn_loc_dir + '/' + clean_manifest_f_nm
+    with open(manifest_path + '.tmp', 'w') as out_f:
+        json.dump(manifest, out_f, indent=2, sort_keys=True)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+
+def get_clean_dest_f_set(imgrtn_loc_dir, clean_opt):
+    """
+    Obtain the names of the cleaned files that exist in the local directory, or
+    in the AWS S3 bucket when the files are streamed to S3.
+
+    Args:
+        (str) imgrtn_loc_dir - immigration location data directory
+        (dict) clean_opt - cleaning options returned by get_clean_opt()
+
+    Returns:
+        (set) dest_f_set - names of the cleaned files
+    """
+
+    s3_out = clean_opt['s3_out']
+    if not s3_out:
+        return set(os.listdir(imgrtn_loc_dir))
+
+    from upload_file_to_aws import open_s3_client, list_s3_objects
+    s3 = open_s3_client(s3_out['upload_opt'])
+    return set(os.path.basename(s3_key)
+               for s3_key in list_s3_objects(s3, s3_out['s3_bucket_nm']))
+
+
+def is_src_file_clean(src_path, dest_f_set, manifest_entry, rules_ver):
+    """
+    Determine whether the cleaned files of a source file are up to date. The
+    content hash is only recalculated when the size or modification time of the
+    source file differ from the manifest entry.
+
+    Args:
+        (str) src_path - immigration source data file path
+        (set) dest_f_set - names of the cleaned files in the local directory or
+                           AWS S3 bucket
+        (dict) manifest_entry - manifest entry of the source file or None
+        (str) rules_ver - current cleaning rules version
+
+    Returns:
+        (bool) is_clean - True when the source file does not need cleaning
+    """
+
+    if manifest_entry is None or manifest_entry['rules_ver'] != rules_ver:
+        return False
+
+    for dest_f_nm in manifest_entry['dest_f_lst']:
+        if dest_f_nm not in dest_f_set:
+            return False
+
+    src_stat = os.stat(src_path)
+    if src_stat.st_size != manifest_entry['size']:
+        return False
+    if src_stat.st_mtime == manifest_entry['mtime']:
+        return True
+
+    # the file was touched; compare its content
+    if calc_file_sha256(src_path) != manifest_entry['sha256']:
+        return False
+
+    manifest_entry['mtime'] = src_stat.st_mtime
+    return True
+
+
+def clean_imgrtn_worker(imgrtn_src_dir, src_f_nm, imgrtn_loc_dir, clean_opt,
+                        part_q=None):
+    """
+    Cleans one immigration data file inside a worker process, catching any
+    error so that a bad file does not stop the other files being cleaned.
+
+    Args:
+        (str) imgrtn_src_dir - immigration source data directory
+        (str) src_f_nm - immigration source data file name
+        (str) imgrtn_loc_dir - immigration location data directory
+        (dict) clean_opt - cleaning options returned by get_clean_opt()
+        (Queue) part_q - queue receiving the completed output file paths
+
+    Returns:
+        (dict) clean_rslt - file name, status code: 1 (error) or 0 (success),
+                            error message of a failed file, cleaned file paths,
+                            fingerprint of the source file, wall time and
+                            number of source rows cleaned
+    """
+
+    clean_rslt = {'src_f_nm': src_f_nm, 'sts_cd': 0, 'err_msg': None
+                  , 'dest_path_lst': [], 'src_fp': None, 'wall_sec': 0.0
+                  , 'row_cnt': None}
+
+    start_ts = dt.datetime.now()
+    pid = os.getpid()
+    cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print('{}: worker {}: cleaning file: {}'.format(cur_ts, pid, src_f_nm))
+    try:
+        # fingerprint the source file before it is read; its content is only
+        # hashed, a full extra read, for incremental cleaning or the cache
+        src_path = imgrtn_src_dir + '/' + src_f_nm
+        src_stat = os.stat(src_path)
+        clean_rslt['src_fp'] = {'size': src_stat.st_size
+                                , 'mtime': src_stat.st_mtime
+                                , 'sha256': None}
+        if clean_opt['incremental'] or clean_opt['cache_dir']:
+            clean_rslt['src_fp']['sha256'] = calc_file_sha256(src_path)
+
+        clean_rslt['dest_path_lst'], clean_rslt['row_cnt'] = clean_imgrtn_file(
+            imgrtn_src_dir, src_f_nm, imgrtn_loc_dir, clean_opt,
+            clean_rslt['src_fp']['sha256'], part_q)
+    except Exception as err:
+        clean_rslt['wall_sec'] = (dt.datetime.now() - start_ts).total_seconds()
+        cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        print('{}: worker {}: failed cleaning file: {}'. \
+                format(cur_ts, pid, src_f_nm))
+        clean_rslt['sts_cd'] = 1
+        clean_rslt['err_msg'] = '{}: {}'.format(type(err).__name__, err)
+        return clean_rslt
+
+    clean_rslt['wall_sec'] = (dt.datetime.now() - start_ts).total_seconds()
+    cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print('{}: worker {}: cleaned file: {} successfully'. \
+            format(cur_ts, pid, src_f_nm))
+    return clean_rslt
+
+
+def clean_imgrtn_data(imgrtn_src_dir, imgrtn_loc_dir, clean_opt,
+                      clean_workers=1, part_q=None, run_rpt=None,
+                      upload_wait_fn=None):
     """
     Reads and cleans immigration data files and store the clean files in a local
-    directory.
-    
+    directory. With more than one worker the files are spread across a pool of
+    processes. In incremental mode, source files whose fingerprint and cleaning
+    rules version match the manifest in the local directory are skipped.
+    With files streamed to AWS S3, the COPY manifest is rewritten once every
+    file is cleaned. When a part queue is given, each cleaned file is put on
+    it as soon as it is complete so that it can be uploaded while the other
+    files are cleaned; the cleaning manifest is then written once
+    upload_wait_fn reports the uploads finished, and a file with a failed
+    upload is not recorded as clean.
+
     Args:
         (str) imgrtn_src_dir - immigration source data directory
         (str) imgrtn_loc_dir - immigration location data directory
+        (dict) clean_opt - cleaning options returned by get_clean_opt()
+        (int) clean_workers - number of worker processes cleaning files
+        (Queue) part_q - queue receiving the completed output file paths; it
+                         must be a managed queue when clean_workers > 1
+        (RunReport) run_rpt - run report recording each file cleaned
+        (function) upload_wait_fn - waits for the uploads of the queued files
+                                    and returns the set of the file names
+                                    that failed to upload
+
+    Returns:
+        (int) sts_cd - status code: 1 (one or more files failed) or 0 (success)
     """
 
     cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     print('{}: cleaning immigration data files in directory: {} '. \
             format(cur_ts, imgrtn_src_dir))
-            
+
     # Obtain the list of immigration data files
     imgrtn_data_f_lst=os.listdir(imgrtn_src_dir)
 
-    for src_f_nm  in imgrtn_data_f_lst:
-        # assemble source data file path
-        src_path = imgrtn_src_dir + '/' + src_f_nm
-        
-        cur_dt = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        print('{}: reading file: {} into data frame'.format(cur_dt, src_path))   
-        imgrtn_df = pd.read_sas(src_path, 'sas7bdat', encoding="ISO-8859-1")
-        
-        # drop columns that are not going to be used in database
-        cur_dt = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        msg = 'dropping columns from data frame that are not going to be used'
-        print('{}: {}'.format(cur_dt, msg))
-              
-        if src_f_nm == 'i94_jun16_sub.sas7bdat':
-            imgrtn_df.drop(['dtadfile', 'entdepa', 'entdepd', 'entdepu'
-                            , 'matflag', 'insnum'
-                            , 'admnum', 'fltno', 'delete_dup', 'delete_visa'
-                            , 'validres', 'delete_recdup', 'delete_days'
-                            , 'delete_mexl'], axis = 1, inplace=True)
-        else:
-            imgrtn_df.drop(['dtadfile', 'entdepa', 'entdepd', 'entdepu'
-                            , 'matflag', 'insnum', 'admnum'
-                            , 'fltno'], axis = 1, inplace=True) 
-        
-        # cleaning data frame columns
-        cur_dt = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        print('{}: cleaning data frame columns'.format(cur_dt))
-        
-        # replace NULL values in i94mode with 9 (Not reported)
-        imgrtn_df["i94mode"].fillna(9, inplace = True)
-        
-        #replace D/S values in dtaddto with 12319999
-        imgrtn_df["dtaddto"].replace({"D/S": '12319999'}, inplace=True)
-        
-        # convert date interger values to date
-        cur_dt = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        msg = 'converting data frame date integer values to dates'
-        print('{}: {}'.format(cur_dt, msg))
-        
-        # convert date integer values
-        imgrtn_df['arrl_date'] = \
-            pd.to_timedelta(imgrtn_df['arrdate'], unit='d', errors='ignore') + \
-            pd.datetime(1960, 1, 1)
-            
-        imgrtn_df['dep_date'] = \
-            pd.to_timedelta(imgrtn_df['depdate'], unit='d', errors='ignore') + \
-            pd.datetime(1960, 1, 1)
-        
-        # drop columns that were converted to real date columns above
-        imgrtn_df.drop(['arrdate', 'depdate'], axis = 1, inplace=True) 
-        
-        # convert columns to correct data types
-        cur_dt = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        msg = 'converting data frame columns to correct data types'
-        print('{}: {}'.format(cur_dt, msg))
-        data_type_dict = {'cicid': int,'i94yr': int,'i94mon': int,'i94visa': int
-                          ,'count': int
-                         } 
-        imgrtn_df = imgrtn_df.astype(data_type_dict)
-
-        # determine path of CSV output file
-        f_nm_prfx = src_f_nm.split(".")[0]
-        dest_path = imgrtn_loc_dir + '/' + f_nm_prfx + '.csv'
-        
-        cur_dt = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        print('{}: writing data frame to file: {}'.format(cur_dt, dest_path))  
-        imgrtn_df.to_csv(dest_path, encoding='utf-8', index=False, header=True)
-        
-        # remove bad characters from data file
-        cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        print('{}: removing bad characters from data file: {}'.\
-            format(cur_ts, dest_path))    
-        cmd=['perl', '-pi', '-e s/[^a-zA-Z0-9,\.\-\n]+//g', dest_path]
-        try:
-            subprocess.run(cmd, check=True)
-            cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            print('{}: cleaned data file: {} successfully'.\
-                format(cur_ts, dest_path))
-        except subprocess.CalledProcessError as err:
-            print(err.stderr.decode('utf-8'))
-            
-        # compress data file
+    # skip the files that are unchanged since they were last cleaned
+    rules_ver = get_clean_rules_ver(clean_opt)
+    manifest = read_clean_manifest(imgrtn_loc_dir)
+    manifest = {src_f_nm: manifest[src_f_nm] for src_f_nm in manifest
+                if src_f_nm in imgrtn_data_f_lst}
+    if clean_opt['incremental']:
+        dest_f_set = get_clean_dest_f_set(imgrtn_loc_dir, clean_opt)
+        clean_f_lst = [src_f_nm for src_f_nm in imgrtn_data_f_lst
+                       if not is_src_file_clean(imgrtn_src_dir + '/' + src_f_nm,
+                                                dest_f_set,
+                                                manifest.get(src_f_nm),
+                                                rules_ver)]
+    else:
+        clean_f_lst = imgrtn_data_f_lst
+
+    cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print('{}: skipping {} unchanged files; cleaning {} files'. \
+            format(cur_ts, len(imgrtn_data_f_lst) - len(clean_f_lst),
+                   len(clean_f_lst)))
+
+    clean_rslt = []
+    if clean_workers > 1:
         cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        print('{}: compress data file: {}'.format(cur_ts, dest_path))  
-        cmd=['gzip', '-f', dest_path]
-        try:
-            subprocess.run(cmd, check=True)
-            cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            print('{}: cleaned data file: {} successfully'.\
-                format(cur_ts, dest_path))
-        except subprocess.CalledProcessError as err:
-            print(err.stderr.decode('utf-8'))
-        
-        #clean data frame  
-        imgrtn_df = imgrtn_df.iloc[0:0]
-        
+        print('{}: cleaning {} files using {} worker processes'. \
+                format(cur_ts, len(clean_f_lst), clean_workers))
+
+        with ProcessPoolExecutor(max_workers=clean_workers) as executor:
+            futures = {executor.submit(clean_imgrtn_worker, imgrtn_src_dir,
+                                       src_f_nm, imgrtn_loc_dir, clean_opt,
+                                       part_q): src_f_nm
+                       for src_f_nm in clean_f_lst}
+            for future in as_completed(futures):
+                try:
+                    clean_rslt.append(future.result())
+                except Exception as err:
+                    # a worker process killed, e.g. out of memory, breaks
+                    # the pool; its file and the files still waiting fail
+                    # while the files already cleaned are kept
+                    clean_rslt.append({'src_f_nm': futures[future]
+                        , 'sts_cd': 1
+                        , 'err_msg': '{}: {}'.format(type(err).__name__, err)
+                        , 'dest_path_lst': [], 'src_fp': None
+                        , 'wall_sec': 0.0, 'row_cnt': None})
+    else:
+        for src_f_nm  in clean_f_lst:
+            clean_rslt.append(clean_imgrtn_worker(imgrtn_src_dir, src_f_nm,
+                                                  imgrtn_loc_dir, clean_opt,
+                                                  part_q))
+
+    # record the wall time, rows and source bytes of each file cleaned
+    if run_rpt is not None:
+        for rslt in clean_rslt:
+            run_rpt.add_step('clean', rslt['src_f_nm'], rslt['wall_sec'],
+                             rslt['row_cnt'],
+                             rslt['src_fp']['size'] if rslt['src_fp'] else None,
+                             sts='success' if rslt['sts_cd'] == 0 else 'error',
+                             err_msg=rslt['err_msg'])
+
+    # record the fingerprint of the files cleaned and uploaded successfully
+    failed_upload_set = set()
+    if upload_wait_fn is not None:
+        failed_upload_set = upload_wait_fn()
+    for rslt in clean_rslt:
+        dest_f_lst = [os.path.basename(dest_path)
+                      for dest_path in rslt['dest_path_lst']]
+        if (rslt['sts_cd'] == 0
+                and not failed_upload_set.intersection(dest_f_lst)):
+            manifest[rslt['src_f_nm']] = dict(rslt['src_fp'],
+                rules_ver=rules_ver, dest_f_lst=dest_f_lst)
+        else:
+            manifest.pop(rslt['src_f_nm'], None)
+    write_clean_manifest(imgrtn_loc_dir, manifest)
+
+    # keep the decoded column cache within its size limit
+    if clean_opt['cache_dir']:
+        evict_cache(clean_opt['cache_dir'], clean_opt['cache_max_mb'],
+                    [manifest[src_f_nm]['sha256'] for src_f_nm in manifest
+                     if manifest[src_f_nm]['sha256']])
+
+    # report the files that failed to be cleaned
+    failed_rslt = [rslt for rslt in clean_rslt if rslt['sts_cd'] == 1]
+    cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print('{}: cleaned {} of {} immigration data files successfully'. \
+            format(cur_ts, len(clean_rslt) - len(failed_rslt),
+                   len(clean_rslt)))
+    for rslt in failed_rslt:
+        print('Error: cleaning file: {}: {}'.format(rslt['src_f_nm'],
+                                                    rslt['err_msg']))
+
+    # files streamed to AWS S3 are never uploaded from the local directory,
+    # so their COPY manifest is written here
+    if clean_opt['s3_out'] is not None and not failed_rslt:
+        from upload_file_to_aws import open_s3_client, write_copy_manifest
+        write_copy_manifest(open_s3_client(clean_opt['s3_out']['upload_opt']),
+                            clean_opt['s3_out']['manifest_url'],
+                            clean_opt['s3_out']['s3_bucket_nm'])
+
+    return(1 if failed_rslt else 0)
+
+
+def get_clean_opt(config):
+    """
+    Obtain the immigration data cleaning options from the CLEAN section of the
+    data warehouse configuration, using defaults for missing options.
+
+    Args:
+        (ConfigParser) config - parsed data warehouse configuration file
+
+    Returns:
+        (dict) clean_opt - cleaning options
+    """
+
+    clean_opt = {
+        'mem_budget_mb': config.getint('CLEAN', 'mem_budget_mb', fallback=0)
+        , 'bad_char_ptrn': config.get('CLEAN', 'bad_char_pattern',
+                                      fallback=bad_char_pattern)
+        , 'out_fmt': config.get('CLEAN', 'out_fmt', fallback='csv')
+        , 'incremental': config.getboolean('CLEAN', 'incremental',
+                                           fallback=False)
+        , 'pre_agg': config.getboolean('CLEAN', 'pre_agg', fallback=False)
+        , 'cache_dir': config.get('CLEAN', 'cache_dir', fallback='')
+        , 'cache_max_mb': config.getint('CLEAN', 'cache_max_mb',
+                                        fallback=0)
+        , 'chunk_q_size': config.getint('PIPELINE', 'chunk_q_size',
+                                        fallback=0)
+        , 'codec_opt': {'codec': config.get('CLEAN', 'codec', fallback='gzip')
+                        , 'level': config.getint('CLEAN', 'codec_level',
+                                                 fallback=6)
+                        , 'threads': config.getint('CLEAN', 'compress_threads',
+                                                   fallback=0)}
+    }
+
+    # stream the cleaned files straight to the immigration bucket
+    if config.get('CLEAN', 'out_target', fallback='local') == 's3':
+        from upload_file_to_aws import get_upload_opt, get_imgrtn_upload_dir
+        from upload_file_to_aws import get_imgrtn_manifest_url
+        clean_opt['s3_out'] = {'upload_opt': get_upload_opt(config)
+                               , 's3_bucket_nm':
+                                   get_imgrtn_upload_dir(config)[1]
+                               , 'manifest_url':
+                                   get_imgrtn_manifest_url(config)}
+    else:
+        clean_opt['s3_out'] = None
+
+    if clean_opt['codec_opt']['codec'] not in codec_f_nm_sfx:
+        raise ValueError('unknown codec: {}'.format(
+                         clean_opt['codec_opt']['codec']))
+    if clean_opt['codec_opt']['codec'] == 'zstd' and zstandard is None:
+        raise ValueError('zstandard is required to write zstd files')
+
+    if clean_opt['cache_dir'] and pa is None:
+        raise ValueError('pyarrow is required to cache decoded SAS columns')
+    if clean_opt['cache_dir']:
+        os.makedirs(clean_opt['cache_dir'], exist_ok=True)
+
+    # number of file parts per month; auto uses the cluster slice count
+    part_cnt = config.get('CLEAN', 'part_cnt', fallback='1')
+    if part_cnt == 'auto':
+        clean_opt['part_cnt'] = get_cluster_slice_cnt(config)
+    else:
+        clean_opt['part_cnt'] = int(part_cnt)
+
+    return clean_opt
+
 def main():
     """
     Parse data warehouse configuration file and call function to clean
     immigration data.
     """
-    
+
     config = configparser.ConfigParser()
     config.read('dwh.cfg')
-    
+
     imgrtn_src_dir = config['SRC_DATA']['imgrtn_data_src_dir']
-    imgrtn_loc_dir = config['SRC_DATA']['imgrtn_data_loc_dir']
-    clean_imgrtn_data(imgrtn_src_dir, imgrtn_loc_dir)
+    clean_opt = get_clean_opt(config)
+
+    # pre-aggregated files are kept apart from the row level files
+    if clean_opt['pre_agg']:
+        imgrtn_loc_dir = config['SRC_DATA']['imgrtn_agg_loc_dir']
+    else:
+        imgrtn_loc_dir = config['SRC_DATA']['imgrtn_data_loc_dir']
+    clean_workers = config.getint('CLEAN', 'clean_workers', fallback=1)
+    run_rpt = RunReport('clean_imgrtn_data')
+    sts_cd = 1
+    try:
+        sts_cd = clean_imgrtn_data(imgrtn_src_dir, imgrtn_loc_dir, clean_opt,
+                                   clean_workers, run_rpt=run_rpt)
+    finally:
+        write_run_report(run_rpt, config, sts_cd)
+    exit(sts_cd)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -2,15 +2,17 @@ import configparser
 import psycopg2
 import datetime as dt
 from sql_redshift_qry import create_tbl_qry, drop_tbl_qry
+from db_access import open_db_pool
 
-def drop_tables(cur, conn):
+def drop_tables(db_pool):
     """
     Drops the staging and target tables using the DDL statements mentioned in
-    the imported dictionary: drop_tbl_qry.
+    the imported dictionary: drop_tbl_qry. A statement failing with a
+    transient error is retried.
     
     Args:
-        (DB cursor) cur - cursor of open DB connection where tables exist
-        (DB connection) conn - open database where the tables exist
+        (DbPool) db_pool - connection pool of the database where the tables
+                           exist
 
     Returns:
         (int) sts_cd - status code: 1 (error) or 0 (success)
@@ -22,8 +24,7 @@ def drop_tables(cur, conn):
 
         query = drop_tbl_qry[tbl_nm]
         try:
-            cur.execute(query)
-            conn.commit()
+            db_pool.execute(query, 'dropping table: {}'.format(tbl_nm))
         except psycopg2.Error as error: 
             print('Error: dropping table: ',  tbl_nm)
             print (error)
@@ -34,14 +35,15 @@ def drop_tables(cur, conn):
     return(0)
 
 
-def create_tables(cur, conn):
+def create_tables(db_pool):
     """
     Creates the staging and target tables using the DDL statements mentioned in
-    the imported dictionary: create_tbl_qry.
+    the imported dictionary: create_tbl_qry. A statement failing with a
+    transient error is retried.
     
     Args:
-        (DB cursor) cur - cursor of open DB connection where tables exist
-        (DB connection) conn - open database where the tables exist
+        (DbPool) db_pool - connection pool of the database where the tables
+                           exist
 
     Returns:
         (int) sts_cd - status code: 1 (error) or 0 (success)
@@ -53,8 +55,7 @@ def create_tables(cur, conn):
         
         query = create_tbl_qry[tbl_nm]
         try:
-            cur.execute(query)
-            conn.commit()
+            db_pool.execute(query, 'creating table: {}'.format(tbl_nm))
         except psycopg2.Error as error: 
             print('Error: creating table: ',  tbl_nm)
             print (error)
@@ -68,8 +69,8 @@ def create_tables(cur, conn):
 
 def main():
     """
-    Establish database connection and initialize cursor variable. Then it delete
-    the DB tables, if they exists, before creating the database tables.  
+    Open the connection pool of the database. Then it delete the DB tables, if
+    they exists, before creating the database tables.  
     
     The DB logon information is read from the configuration file: dwh.cfg stored
     in the application directory
@@ -81,31 +82,16 @@ def main():
     config = configparser.ConfigParser()
     config.read('dwh.cfg')
 
-    print('connecting to DB')
-    try:
-        conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".
-                            format(*config['CLUSTER'].values()))
-                            
-        conn.set_session(autocommit=True)
-        cur = conn.cursor()
-    except psycopg2.Error as error: 
-        print('Error: opening immigration DB')
-        print (error)
-    
-    print('connected to DB')
-    
-    #cur, conn = create_database()
-    if cur == 'none':
+    db_pool = open_db_pool(config, 1)
+    if db_pool == None:
         exit(1)
     
-    sts_cd = drop_tables(cur, conn)
-    if sts_cd == 1:
-        exit(1)
-        
-    sts_cd = create_tables(cur, conn)
+    sts_cd = drop_tables(db_pool)
+    if sts_cd == 0:
+        sts_cd = create_tables(db_pool)
 
-    conn.close()
-    exit(0)
+    db_pool.closeall()
+    exit(sts_cd)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
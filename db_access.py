@@ -0,0 +1,253 @@
+# db_access.py
+
+import random
+import time
+import datetime as dt
+from contextlib import contextmanager
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+
+# SQLSTATEs of transient errors: serialization failure, administrator,
+# crash and startup shutdown, too many connections; the whole connection
+# exception class (08) is retried as well
+retry_sqlstate_lst = ['40001', '57P01', '57P02', '57P03', '53300']
+
+def get_db_opt(config):
+    """
+    Obtain the database access options from the DB section of the data
+    warehouse configuration, using defaults for missing options.
+
+    Args:
+        (ConfigParser) config - parsed data warehouse configuration file
+
+    Returns:
+        (dict) db_opt - database access options
+    """
+
+    return {
+        'connect_timeout': config.getint('DB', 'connect_timeout', fallback=30)
+        , 'retry_cnt': config.getint('DB', 'retry_cnt', fallback=5)
+        , 'retry_base_sec': config.getfloat('DB', 'retry_base_sec',
+                                            fallback=2.0)
+        , 'retry_max_sec': config.getfloat('DB', 'retry_max_sec',
+                                           fallback=60.0)
+        , 'health_check': config.getboolean('DB', 'health_check',
+                                            fallback=True)
+    }
+
+
+def is_retryable(error):
+    """
+    Tells whether a database error is transient, so that the statement or
+    connection failing with it can be tried again: a retryable SQLSTATE, or a
+    lost connection reported without SQLSTATE. Cancelled statements and other
+    operational errors with a SQLSTATE are not retried.
+
+    Args:
+        (Exception) error - error raised by psycopg2
+
+    Returns:
+        (bool) retryable - True when the error is transient
+    """
+
+    if (not isinstance(error, psycopg2.Error)
+            or isinstance(error, psycopg2.extensions.QueryCanceledError)):
+        return False
+    if error.pgcode:
+        return (error.pgcode in retry_sqlstate_lst
+                or error.pgcode.startswith('08'))
+    return isinstance(error, (psycopg2.OperationalError,
+                              psycopg2.InterfaceError))
+
+
+class DbPool:
+    """
+    Pool of connections to the immigration database shared by the scripts and
+    by the concurrent loads of a run. Connections are opened as they are
+    needed, checked with SELECT 1 before being handed out, and closed instead
+    of being returned to the pool once broken. run() retries a unit of work
+    failing with a transient error on a fresh connection, waiting longer after
+    each attempt.
+    """
+
+    def __init__(self, config, max_conn, db_opt=None):
+        self.db_opt = db_opt or get_db_opt(config)
+        self.pool = psycopg2.pool.ThreadedConnectionPool(0, max_conn,
+            "host={} dbname={} user={} password={} port={}".
+            format(*config['CLUSTER'].values()),
+            connect_timeout=self.db_opt['connect_timeout'])
+        self.max_conn = max_conn
+
+    def getconn(self):
+        """
+        Takes a connection of the pool in autocommit mode, opening it if
+        needed. A pooled connection failing the health check is closed and
+        another one is taken.
+
+        Returns:
+            (DB connection) conn - open database connection
+        """
+
+        for check_nbr in range(self.max_conn + 1):
+            conn = self.pool.getconn()
+            try:
+                conn.set_session(autocommit=True)
+                if self.db_opt['health_check']:
+                    with conn.cursor() as cur:
+                        cur.execute('SELECT 1;')
+                return conn
+            except psycopg2.Error:
+                # a stale pooled connection is dropped and another one taken
+                self.putconn(conn, close=True)
+                if (check_nbr == self.max_conn
+                        or not self.db_opt['health_check']):
+                    raise
+
+    def putconn(self, conn, close=False):
+        """
+        Returns a connection to the pool. A closed connection, or one left in
+        a transaction, is closed and dropped from the pool.
+
+        Args:
+            (DB connection) conn - connection taken with getconn()
+            (bool) close - close the connection
+        """
+
+        if not close and not conn.closed:
+            close = (conn.get_transaction_status() !=
+                     psycopg2.extensions.TRANSACTION_STATUS_IDLE)
+        self.pool.putconn(conn, close=close)
+
+    @contextmanager
+    def connection(self):
+        """
+        Lends a connection of the pool to a with block, returning it to the
+        pool at the end of the block, or closing it when the block raised a
+        transient error.
+
+        Yields:
+            (DB connection) conn - open database connection
+        """
+
+        conn = self.getconn()
+        try:
+            yield conn
+        except BaseException as err:
+            self.putconn(conn, close=is_retryable(err))
+            raise
+        self.putconn(conn)
+
+    def run(self, work_fn, work_desc, cancel_evt=None):
+        """
+        Calls work_fn with a connection of the pool and returns its result.
+        A transient error, raised by the work or by opening the connection,
+        retries the work on another connection after a wait of retry_base_sec
+        doubled at each attempt, up to retry_max_sec, with some jitter so that
+        concurrent loads do not retry together. work_fn must be safe to call
+        again after a failure.
+
+        Args:
+            (function) work_fn - function called with the connection
+            (str) work_desc - description of the work in retry messages
+            (Event) cancel_evt - set to stop retrying
+
+        Returns:
+            (object) rslt - result of work_fn
+        """
+
+        retry_cnt = self.db_opt['retry_cnt']
+        for attempt_nbr in range(1, retry_cnt + 2):
+            try:
+                with self.connection() as conn:
+                    return work_fn(conn)
+            except psycopg2.Error as error:
+                if (attempt_nbr > retry_cnt or not is_retryable(error)
+                        or (cancel_evt is not None and cancel_evt.is_set())):
+                    raise
+
+                wait_sec = min(self.db_opt['retry_max_sec'],
+                               self.db_opt['retry_base_sec'] *
+                               2 ** (attempt_nbr - 1))
+                wait_sec *= random.uniform(0.5, 1.0)
+                cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                print('{}: {}: {}: {}; retrying in {:.1f} seconds (retry {} '
+                      'of {})'.format(cur_ts, work_desc, type(error).__name__,
+                      str(error).strip(), wait_sec, attempt_nbr, retry_cnt))
+                if cancel_evt is None:
+                    time.sleep(wait_sec)
+                elif cancel_evt.wait(wait_sec):
+                    raise
+
+    def execute(self, query, work_desc):
+        """
+        Runs a single statement returning no rows, retrying it on a transient
+        error.
+
+        Args:
+            (str) query - SQL statement
+            (str) work_desc - description of the statement in retry messages
+        """
+
+        def exec_qry(conn):
+            with conn.cursor() as cur:
+                cur.execute(query)
+
+        self.run(exec_qry, work_desc)
+
+    def fetchall(self, query, work_desc):
+        """
+        Runs a query and returns its rows, retrying it on a transient error.
+
+        Args:
+            (str) query - SQL query
+            (str) work_desc - description of the query in retry messages
+
+        Returns:
+            (list) row_lst - rows returned by the query
+        """
+
+        def fetch_qry(conn):
+            with conn.cursor() as cur:
+                cur.execute(query)
+                return cur.fetchall()
+
+        return self.run(fetch_qry, work_desc)
+
+    def closeall(self):
+        """
+        Closes every connection of the pool.
+        """
+
+        self.pool.closeall()
+
+
+def open_db_pool(config, max_conn):
+    """
+    Open the pool of connections to the immigration database, checking that
+    the database can be reached, retrying transient errors.
+
+    Args:
+        (ConfigParser) config - parsed data warehouse configuration file
+        (int) max_conn - maximum number of open connections
+
+    Returns:
+        (DbPool) db_pool - connection pool or None on error
+    """
+
+    print('\n###############################################')
+    db_nm = config['CLUSTER']['DB_NAME']
+    cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print('{}: Opening immigration DB: {}'.format(cur_ts, db_nm))
+
+    try:
+        db_pool = DbPool(config, max_conn)
+        db_pool.run(lambda conn: None, 'opening immigration DB')
+    except psycopg2.Error as error:
+        print('Error: opening immigration DB: ', db_nm)
+        print (error)
+        return None
+
+    cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print('{}: Opened immigration DB: {} successfully'.format(cur_ts, db_nm))
+    return db_pool
@@ -1,65 +1,520 @@
 # etl_redshift.py
 
+import argparse
 import configparser
 import psycopg2
 import datetime as dt
 import os
+import re
+import json
+import hashlib
 import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import wait, FIRST_COMPLETED
 from sql_redshift_qry import load_stg_tbl_qry, load_tgt_tbl_qry
-from sql_redshift_qry import data_quality_qry
+from sql_redshift_qry import load_tgt_tbl_dep
+from sql_redshift_qry import data_quality_qry, data_quality_dim
+from sql_redshift_qry import get_missing_key_qry
+from sql_redshift_qry import copy_rowcount_qry, last_qry_id_qry
+from sql_redshift_qry import set_incr_load
+from run_report import RunReport, report_step, write_run_report
+from db_access import open_db_pool
 
-def open_database():
+# tokens of a block of SQL statements: quoted strings and identifiers,
+# comments, statement ending semicolons and the text between them
+sql_token_pattern = re.compile(r"""
+      '(?:[^'\\]|\\.|'')*'?     # string literal
+    | "(?:[^"]|"")*"?           # quoted identifier
+    | --[^\n]*                  # line comment
+    | /\*.*?(?:\*/|$)            # block comment
+    | ;                         # end of statement
+    | [^'";/-]+                 # other text
+    | .
+""", re.VERBOSE | re.DOTALL)
+
+# statements opening and closing an explicit transaction
+txn_begin_verb_lst = ['BEGIN', 'START']
+txn_end_verb_lst = ['END', 'COMMIT', 'ROLLBACK', 'ABORT']
+
+# table an INSERT statement writes to, possibly qualified or quoted
+insert_tbl_pattern = re.compile(r'^INSERT\s+INTO\s+([\w."]+)', re.IGNORECASE)
+
+# temporary tables only live in the session that created them
+temp_tbl_pattern = re.compile(r'^CREATE\s+TEMP(ORARY)?\s+TABLE\s',
+                              re.IGNORECASE)
+
+# arrival month argument of an incremental load
+yr_mnth_pattern = re.compile(r'^\d{4}(0[1-9]|1[0-2])$')
+
+def split_sql_stmt(sql):
     """
-    Open database obtaining connection and cursor objects and return them.
-    
-    Assumes DB logon information is read from the configuration file: dwh.cfg
-    stored in the application directory
-    
-    Return:
-        (DB cursor) cur - cursor of open DB connection
-        (DB connection) conn - connection to target database
+    Splits a block of SQL statements on the semicolons ending them, ignoring
+    the semicolons inside string literals, quoted identifiers and comments.
+    Comments are removed and blank statements dropped.
+
+    Args:
+        (str) sql - block of SQL statements
+
+    Returns:
+        (list) stmt_lst - SQL statements without their ending semicolon
+    """
+
+    stmt_lst, token_lst = [], []
+    for token in sql_token_pattern.findall(sql):
+        if token.startswith('--'):
+            continue
+        if token.startswith('/*'):
+            token_lst.append(' ')
+        elif token == ';':
+            stmt_lst.append(''.join(token_lst).strip())
+            token_lst = []
+        else:
+            token_lst.append(token)
+    stmt_lst.append(''.join(token_lst).strip())
+
+    return [stmt for stmt in stmt_lst if stmt]
+
+
+def get_stmt_verb(stmt):
+    """
+    Returns the first keyword of a SQL statement in upper case.
+
+    Args:
+        (str) stmt - SQL statement without comments
+
+    Returns:
+        (str) verb - statement keyword, e.g. INSERT
+    """
+
+    return stmt.split(None, 1)[0].upper()
+
+
+def get_insert_tbl_nm(stmt):
+    """
+    Returns the unqualified name of the table an INSERT statement writes to.
+
+    Args:
+        (str) stmt - SQL statement without comments
+
+    Returns:
+        (str) tbl_nm - lower case table name, or None for other statements
+    """
+
+    match = insert_tbl_pattern.match(stmt)
+    if match is None:
+        return None
+    return match.group(1).split('.')[-1].strip('"').lower()
+
+
+def group_sql_stmt(stmt_lst):
+    """
+    Groups the statements of a load query into the units that are run and
+    checkpointed as a whole. A transaction, from BEGIN to END, is one group
+    and every other statement is a group of its own. A load creating
+    temporary tables is a single group, since its temporary tables are gone
+    once its session ends.
+
+    Args:
+        (list) stmt_lst - SQL statements of a load query
+
+    Returns:
+        (list) stmt_grp_lst - lists of SQL statements run together
+    """
+
+    if any(temp_tbl_pattern.match(stmt) for stmt in stmt_lst):
+        return [stmt_lst]
+
+    stmt_grp_lst, stmt_grp, in_txn = [], [], False
+    for stmt in stmt_lst:
+        verb = get_stmt_verb(stmt)
+        stmt_grp.append(stmt)
+        if verb in txn_begin_verb_lst:
+            in_txn = True
+        elif verb in txn_end_verb_lst:
+            in_txn = False
+
+        if not in_txn:
+            stmt_grp_lst.append(stmt_grp)
+            stmt_grp = []
+    if stmt_grp:
+        stmt_grp_lst.append(stmt_grp)
+
+    return stmt_grp_lst
+
+
+def open_load_checkpoint(chkpt_path, resume):
+    """
+    Opens the checkpoint of the table loads, which records for each load the
+    hash of its query and the number of its statement groups completed. When
+    resuming, the checkpoint of the last run is read so that the completed
+    groups are skipped; otherwise the last checkpoint is discarded.
+
+    Args:
+        (str) chkpt_path - checkpoint file path
+        (bool) resume - resume the last run from its checkpoint
+
+    Returns:
+        (dict) chkpt - checkpoint file path, completed groups of each load and
+                       lock protecting them
+    """
+
+    chkpt = {'path': chkpt_path, 'load': {}, 'lock': threading.Lock()}
+    if not os.path.exists(chkpt_path):
+        if resume:
+            cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            print('{}: no checkpoint: {}, loading every table'.format(
+                  cur_ts, chkpt_path))
+        return chkpt
+
+    if resume:
+        with open(chkpt_path) as chkpt_f:
+            chkpt['load'] = json.load(chkpt_f)
+        cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        print('{}: resuming from checkpoint: {}'.format(cur_ts, chkpt_path))
+    else:
+        os.remove(chkpt_path)
+
+    return chkpt
+
+
+def get_done_grp_cnt(chkpt, load_key, query):
+    """
+    Returns the number of statement groups of a load completed by the last
+    run, or 0 when the load query changed since.
+
+    Args:
+        (dict) chkpt - checkpoint returned by open_load_checkpoint() or None
+        (str) load_key - stage and table name of the load
+        (str) query - load query
+
+    Returns:
+        (int) done_grp_cnt - number of statement groups completed
+    """
+
+    if chkpt is None:
+        return 0
+
+    with chkpt['lock']:
+        load_chkpt = chkpt['load'].get(load_key)
+    qry_sha256 = hashlib.sha256(query.encode()).hexdigest()
+    if load_chkpt is None or load_chkpt['qry_sha256'] != qry_sha256:
+        return 0
+
+    return load_chkpt['done_grp_cnt']
+
+
+def set_done_grp_cnt(chkpt, load_key, query, done_grp_cnt):
+    """
+    Records the number of statement groups of a load completed and saves the
+    checkpoint, replacing the file in one step so that it is never left
+    partly written.
+
+    Args:
+        (dict) chkpt - checkpoint returned by open_load_checkpoint() or None
+        (str) load_key - stage and table name of the load
+        (str) query - load query
+        (int) done_grp_cnt - number of statement groups completed
+    """
+
+    if chkpt is None:
+        return
+
+    with chkpt['lock']:
+        chkpt['load'][load_key] = {
+            'qry_sha256': hashlib.sha256(query.encode()).hexdigest()
+            , 'done_grp_cnt': done_grp_cnt}
+        tmp_path = chkpt['path'] + '.tmp'
+        with open(tmp_path, 'w') as chkpt_f:
+            json.dump(chkpt['load'], chkpt_f, indent=2)
+        os.replace(tmp_path, chkpt['path'])
+
+
+def exec_stmt_grp(cur, tbl_nm, stmt_grp, stmt_nbr, run_rpt=None,
+                  stage='load'):
+    """
+    Runs a group of statements of a load query one at a time, timing each
+    statement. The records loaded by each COPY statement are counted with
+    pg_last_copy_count() and those of each INSERT into the loaded table by the
+    row count of its command status; inserts into other tables, such as
+    temporary tables, are not counted. When a statement of an explicit
+    transaction fails, the transaction is rolled back before the error is
+    raised.
+
+    Args:
+        (DB cursor) cur - cursor of open DB connection where tables exist
+        (str) tbl_nm - loaded table name
+        (list) stmt_grp - SQL statements of the group
+        (int) stmt_nbr - number of the first statement within the load query
+        (RunReport) run_rpt - run report recording each statement
+        (str) stage - run report stage of the load
+
+    Returns:
+        (list) qry_id_lst - query ids of the statements
+        (int) row_cnt - records loaded into the table by the COPY and INSERT
+                        statements, or None when the group has neither
+    """
+
+    qry_id_lst, row_cnt, in_txn = [], None, False
+    try:
+        for stmt in stmt_grp:
+            verb = get_stmt_verb(stmt)
+            start_ts = dt.datetime.now()
+            cur.execute(stmt)
+            stmt_rowcount = cur.rowcount
+            stmt_nbr += 1
+
+            # transaction statements are not queries of their own
+            if verb in txn_begin_verb_lst:
+                in_txn = True
+                continue
+            if verb in txn_end_verb_lst:
+                in_txn = False
+                continue
+
+            cur.execute(last_qry_id_qry)
+            qry_id_lst.append(cur.fetchone()[0])
+            if verb == 'COPY':
+                cur.execute(copy_rowcount_qry)
+                row_cnt = (row_cnt or 0) + cur.fetchone()[0]
+            elif verb == 'INSERT' and get_insert_tbl_nm(stmt) == tbl_nm:
+                row_cnt = (row_cnt or 0) + max(stmt_rowcount, 0)
+
+            wall_sec = (dt.datetime.now() - start_ts).total_seconds()
+            cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            print('{}: table: {}: statement {} ({}) ran in {:.1f} seconds'.
+                  format(cur_ts, tbl_nm, stmt_nbr, verb, wall_sec))
+            if run_rpt is not None:
+                run_rpt.add_step(stage + '_stmt', '{}.{:02d} {}'.format(
+                                 tbl_nm, stmt_nbr, verb), wall_sec,
+                                 qry_id_lst=qry_id_lst[-1:],
+                                 start_ts=start_ts)
+    except psycopg2.Error:
+        if in_txn:
+            try:
+                cur.execute('ROLLBACK;')
+            except psycopg2.Error:
+                pass
+        raise
+
+    return qry_id_lst, row_cnt
+
+
+def get_load_rowcount(cur, tbl_nm, row_cnt=None, verify_row_cnt=False):
+    """
+    Returns the number of records loaded into a table by a load query, counted
+    by exec_stmt_grp() as its COPY and INSERT statements ran, so that the
+    table is not scanned. A resumed load only counts the records loaded since
+    it resumed. With verify_row_cnt, the records in the table are also counted
+    and printed.
+
+    Args:
+        (DB cursor) cur - cursor of the connection that ran the load query
+        (str) tbl_nm - loaded table name
+        (int) row_cnt - records loaded by the COPY and INSERT statements, or
+                        None when the load ran neither
+        (bool) verify_row_cnt - also count the records in the table
+
+    Returns:
+        (int) rowcount - number of records loaded into the table
+    """
+
+    rowcount = row_cnt or 0
+
+    if verify_row_cnt:
+        cur.execute('SELECT COUNT(*) FROM {};'.format(tbl_nm))
+        cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        print('{}: Verified: table: {} holds {} records'.format(
+              cur_ts, tbl_nm, cur.fetchone()[0]))
+
+    return rowcount
+
+
+def exec_load_qry(cur, tbl_nm, query, verify_row_cnt=False, run_rpt=None,
+                  stage='load', chkpt=None):
+    """
+    Runs the query loading a table statement by statement and returns the
+    number of records loaded, recording the load as a step of the run report,
+    if any, with its wall time, records and query ids. The statement groups
+    completed are saved to the checkpoint, and those completed by the last
+    run are skipped when it is resumed.
+
+    Args:
+        (DB cursor) cur - cursor of open DB connection where tables exist
+        (str) tbl_nm - loaded table name
+        (str) query - copy command or insert queries loading the table
+        (bool) verify_row_cnt - also count the records in the table
+        (RunReport) run_rpt - run report recording the load
+        (str) stage - run report stage of the load
+        (dict) chkpt - checkpoint returned by open_load_checkpoint() or None
+
+    Returns:
+        (int) rowcount - number of records loaded into the table
+    """
+
+    stmt_grp_lst = group_sql_stmt(split_sql_stmt(query))
+    load_key = '{}:{}'.format(stage, tbl_nm)
+    done_grp_cnt = get_done_grp_cnt(chkpt, load_key, query)
+
+    with report_step(run_rpt, stage, tbl_nm) as step_msr:
+        # skip the statement groups completed by the last run
+        stmt_nbr = sum(len(stmt_grp)
+                       for stmt_grp in stmt_grp_lst[:done_grp_cnt])
+        if stmt_nbr > 0:
+            cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            print('{}: table: {}: skipping {} statements completed by the last '
+                  'run'.format(cur_ts, tbl_nm, stmt_nbr))
+
+        row_cnt = None
+        for grp_nbr in range(done_grp_cnt, len(stmt_grp_lst)):
+            stmt_grp = stmt_grp_lst[grp_nbr]
+            qry_id_lst, grp_row_cnt = exec_stmt_grp(cur, tbl_nm, stmt_grp,
+                                                    stmt_nbr, run_rpt, stage)
+            stmt_nbr += len(stmt_grp)
+            step_msr['qry_id_lst'].extend(qry_id_lst)
+            if grp_row_cnt is not None:
+                row_cnt = (row_cnt or 0) + grp_row_cnt
+            set_done_grp_cnt(chkpt, load_key, query, grp_nbr + 1)
+
+        # records loaded into table counted as the statements ran
+        rowcount = get_load_rowcount(cur, tbl_nm, row_cnt, verify_row_cnt)
+        step_msr['row_cnt'] = rowcount
+
+    return rowcount
+
+
+def load_tbl_worker(db_pool, tbl_nm, query, active_conn, conn_lock,
+                    cancel_evt, verify_row_cnt=False, run_rpt=None,
+                    stage='load', chkpt=None):
+    """
+    Loads a table on a connection of the pool, registering the connection
+    while the load query runs so that it can be cancelled. A load failing
+    with a transient error is retried on another connection, from the first
+    statement group not saved to the checkpoint.
+
+    Args:
+        (DbPool) db_pool - connection pool
+        (str) tbl_nm - table name
+        (str) query - copy command or insert queries loading the table
+        (dict) active_conn - connection of each table being loaded
+        (Lock) conn_lock - lock protecting active_conn
+        (Event) cancel_evt - set when another table failed to load
+        (bool) verify_row_cnt - also count the records in the table
+        (RunReport) run_rpt - run report recording the load
+        (str) stage - run report stage of the load
+        (dict) chkpt - checkpoint returned by open_load_checkpoint() or None
+
+    Returns:
+        (int) rowcount - number of records loaded into the table
+    """
+
+    def load_tbl(conn):
+        with conn_lock:
+            if cancel_evt.is_set():
+                raise psycopg2.extensions.QueryCanceledError('load cancelled')
+            active_conn[tbl_nm] = conn
+        try:
+            return exec_load_qry(conn.cursor(), tbl_nm, query, verify_row_cnt,
+                                 run_rpt, stage, chkpt)
+        finally:
+            with conn_lock:
+                active_conn.pop(tbl_nm, None)
+
+    cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print('{}: Loading table: {}'.format(cur_ts, tbl_nm))
+    rowcount = db_pool.run(load_tbl, 'loading table: {}'.format(tbl_nm),
+                           cancel_evt)
+
+    cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print('{}: Loaded: {} into table: {} successfully'\
+        .format(cur_ts, rowcount, tbl_nm))
+    return rowcount
+
+
+def load_stg_tbl_concurrent(db_pool, stg_load_workers, verify_row_cnt=False,
+                            run_rpt=None, chkpt=None):
+    """
+    Loads the staging tables with the copy commands of the imported dictionary
+    load_stg_tbl_qry, running up to stg_load_workers of them at the same time
+    on the connection pool. The immigration staging table is started first so
+    that the small tables load while it is loading. The first error cancels the
+    copy commands still running or waiting, and the outcome of every table is
+    reported.
+
+    Args:
+        (DbPool) db_pool - connection pool
+        (int) stg_load_workers - maximum number of concurrent copy commands
+        (bool) verify_row_cnt - also count the records in each table
+        (RunReport) run_rpt - run report recording each table load
+
+    Returns:
+        (int) sts_cd - status code: 1 (error) or 0 (success)
     """
 
     print('\n###############################################')
     cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    print('{}: Opening immigration database'.format(cur_ts))
-    
-    # open connection to immigration database
-    config = configparser.ConfigParser()
-    config.read('dwh.cfg')
-    
+    print('{}: Loading staging tables using {} connections'.format(
+          cur_ts, stg_load_workers))
+
+    # start the large immigration staging table first
+    tbl_nm_lst = sorted(load_stg_tbl_qry,
+                        key=lambda tbl_nm: not tbl_nm.startswith('imgrtn'))
+
+    active_conn, conn_lock = {}, threading.Lock()
+    cancel_evt = threading.Event()
+    tbl_rslt = {}
+    with ThreadPoolExecutor(max_workers=stg_load_workers) as executor:
+        futures = {executor.submit(load_tbl_worker, db_pool, tbl_nm,
+                                   load_stg_tbl_qry[tbl_nm], active_conn,
+                                   conn_lock, cancel_evt, verify_row_cnt,
+                                   run_rpt, 'load_stg', chkpt): tbl_nm
+                   for tbl_nm in tbl_nm_lst}
+        for future in as_completed(futures):
+            tbl_nm = futures[future]
+            if future.cancelled():
+                tbl_rslt[tbl_nm] = 'cancelled'
+                continue
+
+            try:
+                tbl_rslt[tbl_nm] = '{} records'.format(future.result())
+            except psycopg2.Error as error:
+                if cancel_evt.is_set() and isinstance(error,
+                        psycopg2.extensions.QueryCanceledError):
+                    tbl_rslt[tbl_nm] = 'cancelled'
+                    continue
+
+                tbl_rslt[tbl_nm] = 'Error: {}'.format(error).strip()
+                if not cancel_evt.is_set():
+                    # stop the copy commands waiting or still running
+                    cancel_evt.set()
+                    for pending in futures:
+                        pending.cancel()
+                    with conn_lock:
+                        for conn in active_conn.values():
+                            conn.cancel()
+
+    for tbl_nm in tbl_nm_lst:
+        print('{}: {}'.format(tbl_nm, tbl_rslt.get(tbl_nm, 'cancelled')))
+
+    if cancel_evt.is_set():
+        print('Error: loading staging tables')
+        return(1)
+
     cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    db_nm = config['CLUSTER']['DB_NAME']
-    print('{}: Opening immigration DB: {}'.format(cur_ts, db_nm))
-    
-    try:
-        conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".
-                            format(*config['CLUSTER'].values()))
-                            
-        conn.set_session(autocommit=True)
-        cur = conn.cursor()
-    except psycopg2.Error as error: 
-        print('Error: opening immigration DB: ',  db_nm)
-        print (error)
-        
-        cur, conn = None, None
-        return cur, conn
-    else:
-        cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        print('{}: Opened immigration DB: {} successfully'
-                .format(cur_ts, db_nm))
-        
-    return cur, conn
+    print('{}: Loaded staging tables successfully'.format(cur_ts))
+    return(0)
 
     
-def load_stg_tbl(cur, conn):
+def load_stg_tbl(db_pool, verify_row_cnt=False, run_rpt=None, chkpt=None):
     """
     Loads staging tables using the copy commands mentioned in the imported
-    dictionary: load_stg_tbl_qry.
+    dictionary: load_stg_tbl_qry. A load failing with a transient error is
+    retried on another connection of the pool.
     
     Args:
-        (DB cursor) cur - cursor of open DB connection where tables exist
-        (DB connection) conn - open database where the tables exist
+        (DbPool) db_pool - connection pool
+        (bool) verify_row_cnt - also count the records in each table
+        (RunReport) run_rpt - run report recording each table load
 
     Returns:
         (int) sts_cd - status code: 1 (error) or 0 (success)
@@ -75,17 +530,10 @@ def load_stg_tbl(cur, conn):
             cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             print('{}: Loading table: {}'.format(cur_ts, tbl_nm))
 
-            cur.execute(sql_copy_cmd)
-            conn.commit()
-
-            # count records loaded into table
-            cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            print('{}: Counting records loaded into table: {}'\
-                .format(cur_ts, tbl_nm))
-            
-            query = 'SELECT COUNT(*) FROM {};'.format(tbl_nm)
-            cur.execute(query)
-            rowcount = cur.fetchone()[0]
+            rowcount = db_pool.run(lambda conn: exec_load_qry(
+                                   conn.cursor(), tbl_nm, sql_copy_cmd,
+                                   verify_row_cnt, run_rpt, 'load_stg',
+                                   chkpt), 'loading table: {}'.format(tbl_nm))
 
             cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             print('{}: Loaded: {} into table: {} successfully'\
@@ -101,36 +549,203 @@ def load_stg_tbl(cur, conn):
     return(0)
             
      
-def load_tgt_tbl(cur, conn):
+def get_tgt_load_dep():
+    """
+    Finds the loads each target table load waits for, using the tables read
+    and written by each load in the imported dictionary: load_tgt_tbl_dep. A
+    load waits for every other load writing a table it reads.
+
+    Returns:
+        (dict) upstream - set of the loads each target table load waits for
+
+    Raises:
+        ValueError - a load has no dependencies declared, two loads write the
+            same table or the loads wait for each other
+    """
+
+    undeclared = set(load_tgt_tbl_qry) - set(load_tgt_tbl_dep)
+    if undeclared:
+        raise ValueError('no dependencies declared for: {}'.format(
+                         ', '.join(sorted(undeclared))))
+
+    writer = {}
+    for load_nm in load_tgt_tbl_qry:
+        for tbl_nm in load_tgt_tbl_dep[load_nm]['writes']:
+            if tbl_nm in writer:
+                raise ValueError('table {} written by {} and {}'.format(
+                                 tbl_nm, writer[tbl_nm], load_nm))
+            writer[tbl_nm] = load_nm
+
+    upstream = {load_nm: {writer[tbl_nm]
+                          for tbl_nm in load_tgt_tbl_dep[load_nm]['reads']
+                          if writer.get(tbl_nm, load_nm) != load_nm}
+                for load_nm in load_tgt_tbl_qry}
+
+    # every load must be reachable from the loads without dependencies
+    get_tgt_load_order(upstream)
+    return upstream
+
+
+def get_tgt_load_order(upstream):
+    """
+    Orders the target table loads so that each load comes after the loads it
+    waits for. Loads free to run at the same time are ordered by name, so the
+    order does not depend on the order of the dictionaries.
+
+    Args:
+        (dict) upstream - set of the loads each target table load waits for
+
+    Returns:
+        (list) load_nm_lst - target table loads in load order
+
+    Raises:
+        ValueError - the loads wait for each other
+    """
+
+    waiting = {load_nm: set(dep) for load_nm, dep in upstream.items()}
+    load_nm_lst = []
+    while waiting:
+        ready = sorted(load_nm for load_nm, dep in waiting.items() if not dep)
+        if not ready:
+            raise ValueError('target table loads wait for each other: {}'.
+                             format(', '.join(sorted(waiting))))
+        for load_nm in ready:
+            del waiting[load_nm]
+            load_nm_lst.append(load_nm)
+        for dep in waiting.values():
+            dep.difference_update(ready)
+
+    return load_nm_lst
+
+
+def load_tgt_tbl_concurrent(db_pool, tgt_load_workers, verify_row_cnt=False,
+                            run_rpt=None, chkpt=None):
+    """
+    Loads the target tables with the insert queries of the imported dictionary
+    load_tgt_tbl_qry, running up to tgt_load_workers of them at the same time
+    on the connection pool. A load is started as soon as the loads writing the
+    tables it reads have finished, so the fact table is loaded after its
+    dimensions. The first error cancels the loads still running, the loads
+    waiting for it are not started and the outcome of every table is
+    reported.
+
+    Args:
+        (DbPool) db_pool - connection pool
+        (int) tgt_load_workers - maximum number of concurrent loads
+        (bool) verify_row_cnt - also count the records in each table
+        (RunReport) run_rpt - run report recording each table load
+
+    Returns:
+        (int) sts_cd - status code: 1 (error) or 0 (success)
+    """
+
+    print('\n###############################################')
+    cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print('{}: Loading target tables using {} connections'.format(
+          cur_ts, tgt_load_workers))
+
+    try:
+        upstream = get_tgt_load_dep()
+    except ValueError as error:
+        print('Error: ordering target table loads: {}'.format(error))
+        return(1)
+
+    waiting = {load_nm: set(dep) for load_nm, dep in upstream.items()}
+    active_conn, conn_lock = {}, threading.Lock()
+    cancel_evt = threading.Event()
+    tbl_rslt, running = {}, {}
+    with ThreadPoolExecutor(max_workers=tgt_load_workers) as executor:
+        while True:
+            ready = sorted(load_nm for load_nm, dep in waiting.items()
+                           if not dep)
+            if cancel_evt.is_set():
+                ready = []
+            for load_nm in ready:
+                del waiting[load_nm]
+                future = executor.submit(load_tbl_worker, db_pool, load_nm,
+                                         load_tgt_tbl_qry[load_nm],
+                                         active_conn, conn_lock, cancel_evt,
+                                         verify_row_cnt, run_rpt, 'load_tgt',
+                                         chkpt)
+                running[future] = load_nm
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                load_nm = running.pop(future)
+                if future.cancelled():
+                    tbl_rslt[load_nm] = 'cancelled'
+                    continue
+
+                try:
+                    tbl_rslt[load_nm] = '{} records'.format(future.result())
+                except psycopg2.Error as error:
+                    if cancel_evt.is_set() and isinstance(error,
+                            psycopg2.extensions.QueryCanceledError):
+                        tbl_rslt[load_nm] = 'cancelled'
+                        continue
+
+                    tbl_rslt[load_nm] = 'Error: {}'.format(error).strip()
+                    if not cancel_evt.is_set():
+                        # stop the loads waiting or still running
+                        cancel_evt.set()
+                        for pending in running:
+                            pending.cancel()
+                        with conn_lock:
+                            for conn in active_conn.values():
+                                conn.cancel()
+                    continue
+
+                # release the loads waiting for this one
+                for dep in waiting.values():
+                    dep.discard(load_nm)
+
+    for load_nm in get_tgt_load_order(upstream):
+        print('{}: {}'.format(load_nm, tbl_rslt.get(load_nm, 'not started')))
+
+    if cancel_evt.is_set():
+        print('Error: loading target tables')
+        return(1)
+
+    cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print('{}: Loaded target tables successfully'.format(cur_ts))
+    return(0)
+
+
+def load_tgt_tbl(db_pool, verify_row_cnt=False, run_rpt=None, chkpt=None):
     """
     Inserts data into the target tables using the insert queries mentioned in
-    the imported dictionary: load_tgt_tbl_qry.
+    the imported dictionary: load_tgt_tbl_qry. The tables are loaded in the
+    order of get_tgt_load_order(), so each table is loaded after the tables it
+    reads. A load failing with a transient error is retried on another
+    connection of the pool.
     
     Args:
-        (DB cursor) cur - cursor of open DB connection where tables exist
-        (DB connection) conn - open database where the tables exist
+        (DbPool) db_pool - connection pool
+        (bool) verify_row_cnt - also count the records in each table
+        (RunReport) run_rpt - run report recording each table load
 
     Returns:
         (int) sts_cd - status code: 1 (error) or 0 (success)
     """
     
     print('\n###############################################')
-    for tbl_nm in load_tgt_tbl_qry:
+    try:
+        load_nm_lst = get_tgt_load_order(get_tgt_load_dep())
+    except ValueError as error:
+        print('Error: ordering target table loads: {}'.format(error))
+        return(1)
+
+    for tbl_nm in load_nm_lst:
         query = load_tgt_tbl_qry[tbl_nm]
         try:
             cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             print('{}: Loading data into table: {}'.format(cur_ts, tbl_nm))
-            cur.execute(query)
-            conn.commit()
-              
-            # count records loaded into table
-            cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            print('{}: Counting records loaded into table: {}'\
-                .format(cur_ts, tbl_nm))
-                
-            query = 'SELECT COUNT(*) FROM {};'.format(tbl_nm)
-            cur.execute(query)
-            rowcount = cur.fetchone()[0]
+            rowcount = db_pool.run(lambda conn: exec_load_qry(
+                                   conn.cursor(), tbl_nm, query,
+                                   verify_row_cnt, run_rpt, 'load_tgt',
+                                   chkpt), 'loading table: {}'.format(tbl_nm))
             
             cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             print('{}: Loaded: {} records into target table: {} successfully'.
@@ -144,14 +759,18 @@ def load_tgt_tbl(cur, conn):
     return(0)
     
                       
-def chk_data_quality(cur, conn):
+def chk_data_quality(db_pool, run_rpt=None):
     """
-    Retrieve and prints row count of fact joined to the dimension tables using
-    the select queries mentioned in the imported dictionary: data_quality_qry.
+    Retrieve and prints the fact total and the row count of fact joined to each
+    dimension table in a single scan of the fact table, using the query of the
+    imported data_quality_qry. Every total must equal the fact total; the
+    dimensions dropping fact records are reported with their missing keys.
+    The same query counts the duplicate keys of each dimension, which must
+    have none. The queries are retried on a transient error.
     
     Args:
-        (DB cursor) cur - cursor of open DB connection where tables exist
-        (DB connection) conn - open database where the tables exist
+        (DbPool) db_pool - connection pool
+        (RunReport) run_rpt - run report recording the check
 
     Returns:
         (int) sts_cd - status code: 1 (error) or 0 (success)
@@ -162,63 +781,167 @@ def chk_data_quality(cur, conn):
     cur_dt = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     print(f"{cur_dt}: retrieving fact joined to dimension table totals")
     
-    fct_join_dim_total = {}
-    for data_qlty_nm in data_quality_qry:
-        cur_dt = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        print(f"{cur_dt}: retrieving: {data_qlty_nm}")
+    def get_totals(conn):
+        cur = conn.cursor()
+        cur.execute(data_quality_qry)
+        total_lst = cur.fetchone()
+        cur.execute(last_qry_id_qry)
+        return total_lst, cur.fetchone()[0]
 
-        try:
-            query = data_quality_qry[data_qlty_nm]
-            cur.execute(query)
-            rowcount = cur.fetchone()[0]
-        except psycopg2.Error as error: 
-            print(f"Error: retrieving: {tbl_nm}")
-            print (error)
-            return(1)
-            
-        if rowcount == None:
-            msg=f"No results returned for: {data_qlty_nm}"     
-            raise ValueError(msg)
-                    
-        fct_join_dim_total.setdefault(data_qlty_nm, []) \
-            .append(rowcount)
-        
-        cur_dt = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        msg=f"{data_qlty_nm} is: {fct_join_dim_total[data_qlty_nm][0]}"
-            
-        print(f"{cur_dt}: {msg}")
+    try:
+        with report_step(run_rpt, 'quality', 'imgrtn_data_fct') as step_msr:
+            total_lst, qry_id = db_pool.run(get_totals,
+                                            'retrieving data quality totals')
+            step_msr['qry_id_lst'].append(qry_id)
+    except psycopg2.Error as error: 
+        print("Error: retrieving fact joined to dimension table totals")
+        print (error)
+        return(1)
+
+    data_qlty_nm_lst = ['imgrtn_total'] + list(data_quality_dim)
+    fct_join_dim_total = dict(zip(data_qlty_nm_lst, total_lst))
+    dup_key_cnt = dict(zip(data_quality_dim,
+                           total_lst[len(data_qlty_nm_lst):]))
+    if fct_join_dim_total['imgrtn_total'] == None:
+        msg=f"No results returned for: imgrtn_total"     
+        raise ValueError(msg)
+
+    cur_dt = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    for data_qlty_nm in data_qlty_nm_lst:
+        print(f"{cur_dt}: {data_qlty_nm} is: {fct_join_dim_total[data_qlty_nm]}")
     
     cur_dt = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     print(f"{cur_dt}: confirming all totals match")
     
-    prev_rec_cnt = None
-    prev_data_qlty_nm = None
-    for data_qlty_nm in fct_join_dim_total:
-        cur_rec_cnt = fct_join_dim_total[data_qlty_nm][0]
-        if prev_rec_cnt == None:
-            prev_rec_cnt = cur_rec_cnt
-            prev_data_qlty_nm = data_qlty_nm
-        else:
-            if prev_rec_cnt != cur_rec_cnt:
-                msg=f"Data quality check failed. {prev_data_qlty_nm} \
-                    and {data_qlty_nm} total are not equal"
-                    
-                raise ValueError(msg)
-
-            else:
-                prev_rec_cnt = cur_rec_cnt
-                prev_data_qlty_nm = data_qlty_nm
+    imgrtn_total = fct_join_dim_total['imgrtn_total']
+    failed_lst = [data_qlty_nm for data_qlty_nm in data_quality_dim
+                  if fct_join_dim_total[data_qlty_nm] != imgrtn_total]
+    for data_qlty_nm in failed_lst:
+        dim = data_quality_dim[data_qlty_nm]
+        print(f"Error: {dim['dim_tbl']} is missing "
+              f"{imgrtn_total - fct_join_dim_total[data_qlty_nm]} immigrants "
+              f"of imgrtn_data_fct")
+        try:
+            for key_val, imgrnt_cnt, rec_cnt in db_pool.fetchall(
+                    get_missing_key_qry(data_qlty_nm),
+                    'retrieving missing keys of: {}'.format(dim['dim_tbl'])):
+                print(f"    {dim['fct_key']}: {key_val}: {imgrnt_cnt} "
+                      f"immigrants in {rec_cnt} fact records")
+        except psycopg2.Error as error: 
+            print(f"Error: retrieving missing keys of: {dim['dim_tbl']}")
+            print (error)
+
+    # a duplicate dimension key would join a fact record more than once
+    dup_lst = []
+    for data_qlty_nm, dim in data_quality_dim.items():
+        if dup_key_cnt[data_qlty_nm]:
+            dup_lst.append(dim['dim_tbl'])
+            print(f"Error: {dim['dim_tbl']} has {dup_key_cnt[data_qlty_nm]} "
+                  f"duplicate {dim['dim_key']} values")
+
+    msg_lst = []
+    if failed_lst:
+        msg_lst.append(f"imgrtn_total is not equal to: {', '.join(failed_lst)}")
+    if dup_lst:
+        msg_lst.append(f"duplicate keys in: {', '.join(dup_lst)}")
+    if msg_lst:
+        msg=f"Data quality check failed. {'; '.join(msg_lst)}"
+        raise ValueError(msg)
                 
     cur_dt = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    print(f"{cur_dt}: successfully confirm all totals: {cur_rec_cnt} match")
+    print(f"{cur_dt}: successfully confirm all totals: {imgrtn_total} match")
     return(0)
    
    
+def get_yr_mnth_lst(arg_lst):
+    """
+    Split and check the arrival months given on the command line, each
+    argument holding one or more comma separated months.
+
+    Args:
+        (list) arg_lst - --months arguments
+
+    Returns:
+        (list) yr_mnth_lst - sorted distinct arrival months (YYYYMM)
+
+    Raises:
+        ValueError - an argument is not a YYYYMM month
+    """
+
+    yr_mnth_set = set()
+    for arg in arg_lst:
+        for yr_mnth in arg.split(','):
+            yr_mnth = yr_mnth.strip()
+            if not yr_mnth_pattern.match(yr_mnth):
+                raise ValueError('invalid month: {}, expected YYYYMM'.
+                                 format(yr_mnth))
+            yr_mnth_set.add(yr_mnth)
+
+    return sorted(yr_mnth_set)
+
+
+def run_etl(config, stg_load_workers, tgt_load_workers, verify_row_cnt,
+            run_rpt, chkpt=None):
+    """
+    Opens the connection pool of the immigration database, loads the staging
+    and target tables and checks the data quality of the target tables.
+
+    Args:
+        (ConfigParser) config - parsed data warehouse configuration file
+        (int) stg_load_workers - number of staging tables loaded at a time
+        (int) tgt_load_workers - number of target tables loaded at a time
+        (bool) verify_row_cnt - also count the records in each table
+        (RunReport) run_rpt - run report recording each step
+        (dict) chkpt - checkpoint returned by open_load_checkpoint() or None
+
+    Returns:
+        (int) sts_cd - status code: 1 (error) or 0 (success)
+    """
+
+    # one pool serves the sequential and concurrent loads and the checks
+    db_pool = open_db_pool(config, max(stg_load_workers, tgt_load_workers, 1))
+    if db_pool == None:
+        return(1)
+
+    try:
+        # load data into stage tables, several at a time when configured
+        if stg_load_workers > 1:
+            sts_cd = load_stg_tbl_concurrent(db_pool, stg_load_workers,
+                                             verify_row_cnt, run_rpt, chkpt)
+        else:
+            sts_cd = load_stg_tbl(db_pool, verify_row_cnt, run_rpt, chkpt)
+        if sts_cd == 1:
+            return(1)
+
+        # load data into target tables, dimensions before the fact table
+        if tgt_load_workers > 1:
+            sts_cd = load_tgt_tbl_concurrent(db_pool, tgt_load_workers,
+                                             verify_row_cnt, run_rpt, chkpt)
+        else:
+            sts_cd = load_tgt_tbl(db_pool, verify_row_cnt, run_rpt, chkpt)
+        if sts_cd == 1:
+            return(1)
+
+        # check data quality
+        return(chk_data_quality(db_pool, run_rpt))
+    finally:
+        db_pool.closeall()
+
+
 def main():
     """
     Establish database connection and initialize a cursor variable. Then
     load the staging and target tables respectively. Finally perform data
     quality check on the target tables.
+
+    With --months, only those arrival months are loaded: the immigration
+    staging table is loaded from their objects and only the dimensions coded
+    by the immigration data, the time period dimension and the months' fact
+    rows are rebuilt.
+
+    The statement groups completed are saved to a checkpoint file, which is
+    removed once the run succeeds. With --resume, a failed run is restarted
+    from the statement group that failed.
     
     The DB logon information is read from the configuration file: dwh.cfg stored
     in the application directory
@@ -227,30 +950,53 @@ def main():
         (int) exit_cd - exit status code: 1 (error) or 0 (success)
     """
     
-    # open database and obtain connection and cursor objects
-    cur, conn = open_database()
-    if cur == None:
-        exit(1)
+    parser = argparse.ArgumentParser(
+        description='Load the staging and target tables of the immigration DB')
+    parser.add_argument('--months', nargs='+', metavar='YYYYMM',
+                        help='load only these arrival months incrementally')
+    parser.add_argument('--resume', action='store_true',
+                        help='skip the statements completed by the last run')
+    args = parser.parse_args()
 
-    # load data into stage tables except immigration stage
-    sts_cd = load_stg_tbl(cur, conn)
-    if sts_cd == 1:
-        conn.close()
-        exit(1)
+    if args.months:
+        try:
+            yr_mnth_lst = get_yr_mnth_lst(args.months)
+            set_incr_load(yr_mnth_lst)
+        except ValueError as error:
+            print('Error: incremental load: {}'.format(error))
+            exit(1)
 
-    # load data into target dimension tables except for time period dimension 
-    sts_cd = load_tgt_tbl(cur, conn)
-    if sts_cd == 1:
-        conn.close()
-        exit(1)
+        cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        print('{}: Loading months: {} incrementally'.format(
+              cur_ts, ', '.join(yr_mnth_lst)))
 
-    # check data quality
-    sts_cd = chk_data_quality(cur, conn)
-    conn.close()
-    if sts_cd == 1:
+    config = configparser.ConfigParser()
+    config.read('dwh.cfg')
+    if config.get('ETL', 'imgrtn_months', fallback=''):
+        print('Error: imgrtn_months is no longer supported, a full load '
+              'stages every month; use --months to load some months')
         exit(1)
-    
-    exit(0)
+    stg_load_workers =config.getint('ETL', 'stg_load_workers', fallback=1)
+    tgt_load_workers = config.getint('ETL', 'tgt_load_workers', fallback=1)
+    verify_row_cnt = config.getboolean('ETL', 'verify_row_cnt', fallback=False)
+    chkpt = open_load_checkpoint(config.get('ETL', 'checkpoint_path',
+                                            fallback='etl_checkpoint.json'),
+                                 args.resume)
+
+    # report the steps run, whatever the exit status
+    run_rpt = RunReport('etl_redshift')
+    sts_cd = 1
+    try:
+        sts_cd = run_etl(config, stg_load_workers, tgt_load_workers,
+                         verify_row_cnt, run_rpt, chkpt)
+    finally:
+        write_run_report(run_rpt, config, sts_cd)
+
+    # a later run starts from the beginning once this one succeeded
+    if sts_cd == 0 and os.path.exists(chkpt['path']):
+        os.remove(chkpt['path'])
+
+    exit(sts_cd)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,217 @@
+import configparser
+import os
+import threading
+import multiprocessing
+import datetime as dt
+from clean_imgrtn_data import get_clean_opt, clean_imgrtn_data
+from upload_file_to_aws import upload_file_to_s3, upload_to_aws
+from upload_file_to_aws import get_imgrtn_upload_dir, get_upload_opt
+from upload_file_to_aws import open_s3_client, get_transfer_config
+from upload_file_to_aws import get_imgrtn_manifest_url, write_copy_manifest
+from upload_file_to_aws import get_s3_key, split_s3_url
+from upload_file_to_aws import delete_stale_s3_objects, delete_s3_objects
+from run_report import RunReport, write_run_report
+
+
+def upload_worker(s3, part_q, s3_bucket_nm, upload_opt, transfer_cfg,
+                  upload_rslt, rslt_lock, run_rpt=None):
+    """
+    Uploads the cleaned files put on the part queue until it receives the end
+    of queue marker (None). A failed upload is recorded and the worker moves on
+    to the next file so that the cleaning processes never wait on a full queue.
+
+    Args:
+        (S3.Client) s3 - AWS S3 client
+        (Queue) part_q - queue of the cleaned file paths to upload
+        (str) s3_bucket_nm - AWS S3 bucket name
+        (dict) upload_opt - upload options returned by get_upload_opt()
+        (TransferConfig) transfer_cfg - multipart transfer settings
+        (dict) upload_rslt - uploaded objects and bytes, failed file paths
+        (Lock) rslt_lock - lock protecting upload_rslt
+        (RunReport) run_rpt - run report recording each file uploaded
+    """
+
+    while True:
+        src_f_path = part_q.get()
+        if src_f_path is None:
+            break
+
+        s3_key = get_s3_key(os.path.basename(src_f_path),
+                            upload_opt['key_layout'])
+        try:
+            f_size = os.path.getsize(src_f_path)
+            sts_cd = upload_file_to_s3(s3, src_f_path, s3_bucket_nm, s3_key,
+                                       transfer_cfg, run_rpt=run_rpt)
+        except Exception as err:
+            print('Error: uploading file: {}: {}: {}'.format(
+                  src_f_path, type(err).__name__, err))
+            sts_cd = 1
+
+        with rslt_lock:
+            if sts_cd == 0:
+                upload_rslt['s3_obj_lst'].append(
+                    ('s3://{}/{}'.format(s3_bucket_nm, s3_key), f_size,
+                     src_f_path))
+                upload_rslt['byte_cnt'] += f_size
+            else:
+                upload_rslt['failed_f_lst'].append(src_f_path)
+
+
+def delete_partial_uploads(s3, s3_bucket_nm, upload_rslt):
+    """
+    Deletes the objects of the source files that were not cleaned and uploaded
+    completely: a part of the file failed to upload, or its cleaning failed
+    after some parts were uploaded and removed its local output files. Such a
+    file is cleaned and uploaded again by the next run; until then a COPY of
+    the bucket would load its parts already uploaded, mixed with the parts of
+    the earlier upload, so every object of the file is deleted.
+
+    Args:
+        (S3.Client) s3 - AWS S3 client
+        (str) s3_bucket_nm - AWS S3 bucket name
+        (dict) upload_rslt - uploaded objects and bytes, failed file paths
+    """
+
+    failed_prfx_set = {os.path.basename(src_f_path).split('.')[0]
+                       for src_f_path in upload_rslt['failed_f_lst']}
+    failed_prfx_set.update(os.path.basename(src_f_path).split('.')[0]
+                           for s3_url, f_size, src_f_path
+                           in upload_rslt['s3_obj_lst']
+                           if not os.path.exists(src_f_path))
+
+    for f_nm_prfx in sorted(failed_prfx_set):
+        for key_layout in ['flat', 'partitioned']:
+            delete_s3_objects(s3, s3_bucket_nm,
+                              get_s3_key(f_nm_prfx, key_layout) + '.')
+        cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        print('{}: deleted the objects of file: {} from bucket: {}'.format(
+              cur_ts, f_nm_prfx, s3_bucket_nm))
+
+
+def run_imgrtn_pipeline(config, run_rpt=None):
+    """
+    Cleans the immigration data files and uploads them to AWS S3 at the same
+    time. Each cleaned file, or file part, is put on a bounded queue as soon as
+    it is written and a pool of upload threads sends it to AWS S3, so that
+    decoding, compression and upload overlap. A full queue makes the cleaning
+    processes wait, which bounds the cleaned data waiting on the local disk.
+    The objects of a file that failed are deleted from the bucket.
+    When every file is cleaned and uploaded, the objects left by earlier
+    uploads of the cleaned files are deleted and a COPY manifest listing every
+    object of the bucket is written.
+
+    Args:
+        (ConfigParser) config - parsed data warehouse configuration file
+        (RunReport) run_rpt - run report recording each file cleaned and
+                              uploaded
+
+    Returns:
+        (int) sts_cd - status code: 1 (error) or 0 (success)
+    """
+
+    upload_opt = get_upload_opt(config)
+    s3 = open_s3_client(upload_opt)
+    transfer_cfg = get_transfer_config(upload_opt)
+    upload_workers = config.getint('PIPELINE', 'upload_workers', fallback=1)
+    upload_q_size = config.getint('PIPELINE', 'upload_q_size', fallback=8)
+
+    # upload misc data files to AWS S3 bucket
+    misc_data_loc_dir = config['SRC_DATA']['misc_data_loc_dir']
+    s3_bucket_nm = config['S3']['s3_misc_data_bucket']
+    sts_cd = upload_to_aws(s3, misc_data_loc_dir, s3_bucket_nm, upload_opt,
+                           run_rpt=run_rpt)
+    if sts_cd == 1:
+        return(1)
+
+    imgrtn_src_dir = config['SRC_DATA']['imgrtn_data_src_dir']
+    clean_opt = get_clean_opt(config)
+    clean_workers = config.getint('CLEAN', 'clean_workers', fallback=1)
+    imgrtn_loc_dir, s3_bucket_nm = get_imgrtn_upload_dir(config)
+
+    start_ts = dt.datetime.now()
+    print('{}: starting pipeline with {} clean workers, {} upload workers and '
+          'an upload queue of {} files'.format(
+          start_ts.strftime("%Y-%m-%d %H:%M:%S"), clean_workers,
+          upload_workers, upload_q_size))
+
+    upload_rslt = {'s3_obj_lst': [], 'byte_cnt': 0, 'failed_f_lst': []}
+    rslt_lock = threading.Lock()
+
+    # the queue is shared with the cleaning processes through a manager
+    with multiprocessing.Manager() as manager:
+        part_q = manager.Queue(maxsize=upload_q_size)
+        uploader_lst = [threading.Thread(target=upload_worker,
+                                         args=(s3, part_q, s3_bucket_nm,
+                                               upload_opt, transfer_cfg,
+                                               upload_rslt, rslt_lock,
+                                               run_rpt))
+                        for _ in range(upload_workers)]
+        for uploader in uploader_lst:
+            uploader.start()
+
+        upload_fin_evt = threading.Event()
+
+        def finish_upload():
+            # one end of queue marker per upload worker, sent once
+            if not upload_fin_evt.is_set():
+                upload_fin_evt.set()
+                for _ in uploader_lst:
+                    part_q.put(None)
+                for uploader in uploader_lst:
+                    uploader.join()
+            return {os.path.basename(src_f_path)
+                    for src_f_path in upload_rslt['failed_f_lst']}
+
+        # the cleaning manifest is written once the uploads are finished,
+        # so that a file whose upload failed is cleaned and uploaded again
+        try:
+            clean_sts_cd = clean_imgrtn_data(imgrtn_src_dir, imgrtn_loc_dir,
+                                             clean_opt, clean_workers, part_q,
+                                             run_rpt, finish_upload)
+        finally:
+            finish_upload()
+
+    elapsed_sec = (dt.datetime.now() - start_ts).total_seconds()
+    cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print('{}: uploaded {} files ({:.1f} MB) in {:.1f} seconds'.format(
+          cur_ts, len(upload_rslt['s3_obj_lst']),
+          upload_rslt['byte_cnt'] / 2**20,
+          elapsed_sec))
+    for src_f_path in upload_rslt['failed_f_lst']:
+        print('Error: failed to upload file: {}'.format(src_f_path))
+
+    if clean_sts_cd == 1 or upload_rslt['failed_f_lst']:
+        delete_partial_uploads(s3, s3_bucket_nm, upload_rslt)
+        return(1)
+
+    # the cleaning removed the earlier objects of the files streamed to AWS S3
+    # and wrote their manifest
+    if clean_opt['s3_out'] is None:
+        delete_stale_s3_objects(s3, s3_bucket_nm,
+                                [split_s3_url(s3_url)[1] for s3_url, f_size,
+                                 src_f_path in upload_rslt['s3_obj_lst']])
+        write_copy_manifest(s3, get_imgrtn_manifest_url(config),
+                            s3_bucket_nm)
+
+    return(0)
+
+
+def main():
+    """
+    Parse data warehouse configuration file and call function to clean and
+    upload the immigration data in a single pipeline.
+    """
+
+    config = configparser.ConfigParser()
+    config.read('dwh.cfg')
+
+    run_rpt = RunReport('run_imgrtn_pipeline')
+    sts_cd = 1
+    try:
+        sts_cd = run_imgrtn_pipeline(config, run_rpt)
+    finally:
+        write_run_report(run_rpt, config, sts_cd)
+    exit(sts_cd)
+
+if __name__ == "__main__":
+    main()
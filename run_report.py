@@ -0,0 +1,231 @@
+# run_report.py
+
+import os
+import json
+import threading
+import datetime as dt
+from contextlib import contextmanager, nullcontext
+
+
+class RunReport:
+    """
+    Records the stages and steps of a run, such as the files cleaned and
+    uploaded or the tables loaded, with their wall time, rows, bytes and
+    database query ids, so that they can be written as a JSON run report and
+    printed as a summary table. Steps may be recorded from several threads.
+    """
+
+    def __init__(self, run_nm):
+        self.run_nm = run_nm
+        self.start_ts = dt.datetime.now()
+        self.step_lst = []
+        self.lock = threading.Lock()
+
+    def add_step(self, stage, step_nm, wall_sec, row_cnt=None, byte_cnt=None,
+                 qry_id_lst=None, sts='success', err_msg=None, start_ts=None):
+        """
+        Records a step measured by the caller, for instance in a worker
+        process.
+
+        Args:
+            (str) stage - stage of the run, e.g. load_stg
+            (str) step_nm - step name, e.g. a table or file name
+            (float) wall_sec - wall time of the step in seconds
+            (int) row_cnt - number of rows processed, if known
+            (int) byte_cnt - number of bytes processed, if known
+            (list) qry_id_lst - database query ids of the step
+            (str) sts - step status: success or error
+            (str) err_msg - error message of a failed step
+            (datetime) start_ts - start time of the step; defaults to now
+                                  minus the wall time
+        """
+
+        if start_ts is None:
+            start_ts = dt.datetime.now() - dt.timedelta(seconds=wall_sec)
+
+        step = {'stage': stage, 'step': step_nm
+                , 'start_ts': start_ts.isoformat(timespec='seconds')
+                , 'wall_sec': round(wall_sec, 3), 'row_cnt': row_cnt
+                , 'byte_cnt': byte_cnt, 'qry_id_lst': qry_id_lst or []
+                , 'sts': sts, 'err_msg': err_msg}
+        with self.lock:
+            self.step_lst.append(step)
+
+    @contextmanager
+    def step(self, stage, step_nm):
+        """
+        Times the statements of a with block as a step. The block fills in the
+        row_cnt, byte_cnt and qry_id_lst keys of the yielded dictionary; an
+        exception raised by the block records the step as failed and is
+        raised again.
+
+        Args:
+            (str) stage - stage of the run, e.g. load_stg
+            (str) step_nm - step name, e.g. a table or file name
+
+        Yields:
+            (dict) step_msr - measures of the step filled in by the block
+        """
+
+        step_msr = {'row_cnt': None, 'byte_cnt': None, 'qry_id_lst': []}
+        start_ts = dt.datetime.now()
+        try:
+            yield step_msr
+        except BaseException as err:
+            self.add_step(stage, step_nm,
+                          (dt.datetime.now() - start_ts).total_seconds(),
+                          step_msr['row_cnt'], step_msr['byte_cnt'],
+                          step_msr['qry_id_lst'], 'error',
+                          '{}: {}'.format(type(err).__name__, err).strip(),
+                          start_ts)
+            raise
+
+        self.add_step(stage, step_nm,
+                      (dt.datetime.now() - start_ts).total_seconds(),
+                      step_msr['row_cnt'], step_msr['byte_cnt'],
+                      step_msr['qry_id_lst'], 'success', None, start_ts)
+
+    def get_stage_totals(self):
+        """
+        Sums the steps of each stage, in the order the stages were started.
+
+        Returns:
+            (dict) stage_totals - step count, wall time, rows, bytes and
+                                  failed step count of each stage
+        """
+
+        stage_totals = {}
+        with self.lock:
+            step_lst = sorted(self.step_lst, key=lambda step: step['start_ts'])
+        for step in step_lst:
+            total = stage_totals.setdefault(step['stage'],
+                {'step_cnt': 0, 'wall_sec': 0.0, 'row_cnt': 0, 'byte_cnt': 0
+                 , 'failed_cnt': 0})
+            total['step_cnt'] += 1
+            total['wall_sec'] = round(total['wall_sec'] + step['wall_sec'], 3)
+            total['row_cnt'] += step['row_cnt'] or 0
+            total['byte_cnt'] += step['byte_cnt'] or 0
+            total['failed_cnt'] += step['sts'] != 'success'
+
+        return stage_totals
+
+    def to_dict(self, sts_cd=None):
+        """
+        Returns the run report as a dictionary.
+
+        Args:
+            (int) sts_cd - status code of the run, if finished
+
+        Returns:
+            (dict) run_rpt - run name, start time, wall time, status code,
+                             stage totals and steps
+        """
+
+        with self.lock:
+            step_lst = list(self.step_lst)
+
+        return {'run_nm': self.run_nm
+                , 'start_ts': self.start_ts.isoformat(timespec='seconds')
+                , 'wall_sec': round((dt.datetime.now() -
+                                     self.start_ts).total_seconds(), 3)
+                , 'sts_cd': sts_cd
+                , 'stage_totals': self.get_stage_totals()
+                , 'step_lst': step_lst}
+
+    def write_json(self, report_dir, sts_cd=None):
+        """
+        Writes the run report to a JSON file of the report directory, named
+        after the run and its start time.
+
+        Args:
+            (str) report_dir - run report directory
+            (int) sts_cd - status code of the run, if finished
+
+        Returns:
+            (str) report_path - path of the JSON run report
+        """
+
+        os.makedirs(report_dir, exist_ok=True)
+        report_path = os.path.join(report_dir, '{}_{}.json'.format(
+                                   self.run_nm,
+                                   self.start_ts.strftime("%Y%m%d_%H%M%S")))
+        with open(report_path, 'w') as report_f:
+            json.dump(self.to_dict(sts_cd), report_f, indent=2)
+
+        return report_path
+
+    def print_summary(self):
+        """
+        Prints a summary table of the steps, slowest first within each stage,
+        followed by the stage totals.
+        """
+
+        with self.lock:
+            step_lst = list(self.step_lst)
+        stage_totals = self.get_stage_totals()
+
+        print('\n###############################################')
+        print('Run report: {}'.format(self.run_nm))
+        row_fmt = '{:<10} {:<34} {:>10} {:>14} {:>10} {:<7}'
+        print(row_fmt.format('stage', 'step', 'seconds', 'rows', 'MB',
+                             'status'))
+        for stage in stage_totals:
+            stage_step_lst = sorted([step for step in step_lst
+                                     if step['stage'] == stage],
+                                    key=lambda step: -step['wall_sec'])
+            for step in stage_step_lst:
+                print(row_fmt.format(stage, step['step'][:34],
+                      '{:.1f}'.format(step['wall_sec']),
+                      '' if step['row_cnt'] is None else step['row_cnt'],
+                      '' if step['byte_cnt'] is None else
+                      '{:.1f}'.format(step['byte_cnt'] / 2**20),
+                      step['sts']))
+        for stage, total in stage_totals.items():
+            print(row_fmt.format(stage, '{} steps, {} failed'.format(
+                  total['step_cnt'], total['failed_cnt']),
+                  '{:.1f}'.format(total['wall_sec']), total['row_cnt'],
+                  '{:.1f}'.format(total['byte_cnt'] / 2**20), 'total'))
+        print('run wall time: {:.1f} seconds'.format(
+              (dt.datetime.now() - self.start_ts).total_seconds()))
+
+
+def report_step(run_rpt, stage, step_nm):
+    """
+    Returns the context timing a step of a run report, or a context recording
+    nothing when there is no run report, so that callers can always fill in
+    the step measures.
+
+    Args:
+        (RunReport) run_rpt - run report or None
+        (str) stage - stage of the run
+        (str) step_nm - step name
+
+    Returns:
+        (context manager) step_ctx - context yielding the step measures
+    """
+
+    if run_rpt is None:
+        return nullcontext({'row_cnt': None, 'byte_cnt': None,
+                            'qry_id_lst': []})
+    return run_rpt.step(stage, step_nm)
+
+
+def write_run_report(run_rpt, config, sts_cd=None):
+    """
+    Prints the summary table of a run and writes its JSON run report to the
+    report_dir of the REPORT section of the data warehouse configuration,
+    unless it is empty.
+
+    Args:
+        (RunReport) run_rpt - run report
+        (ConfigParser) config - parsed data warehouse configuration file
+        (int) sts_cd - status code of the run
+    """
+
+    run_rpt.print_summary()
+
+    report_dir = config.get('REPORT', 'report_dir', fallback='')
+    if report_dir:
+        report_path = run_rpt.write_json(report_dir, sts_cd)
+        cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        print('{}: wrote run report: {}'.format(cur_ts, report_path))
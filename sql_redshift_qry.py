@@ -16,6 +16,7 @@ state_stg_tbl_drop = "DROP TABLE IF EXISTS state_stg;"
 city_temp_stg_tbl_drop = "DROP TABLE IF EXISTS city_temp_stg;"
 airport_stg_tbl_drop = "DROP TABLE IF EXISTS airport_stg;"
 imgrtn_data_stg_tbl_drop = "DROP TABLE IF EXISTS imgrtn_data_stg;"
+imgrtn_agg_stg_tbl_drop = "DROP TABLE IF EXISTS imgrtn_agg_stg;"
 
 # compose drop dimension and fact tables queries
 city_demogrphc_dim_tbl_drop = "DROP TABLE IF EXISTS city_demogrphc_dim;"
@@ -121,31 +122,76 @@ airport_stg_tbl_create = ("""
     )
 """)
 
+################################################################################
+# Immigration staging table columns. Each entry is the staging column, the SAS
+# source column it is populated from and its data type. The cleaning script
+# decodes only these source columns and the staging DDL is composed from them.
+# The data types match the cleaned data so that the Parquet files written by
+# the cleaning script can be loaded with COPY FORMAT AS PARQUET.
+################################################################################
+
+imgrtn_stg_col = [
+      ('cicid', 'cicid', 'INT PRIMARY KEY')
+    , ('i94yr', 'i94yr', 'SMALLINT')
+    , ('i94mon', 'i94mon', 'SMALLINT')
+    , ('i94cit', 'i94cit', 'SMALLINT')
+    , ('i94res', 'i94res', 'SMALLINT')
+    , ('i94port', 'i94port', 'TEXT')
+    , ('i94mode', 'i94mode', 'SMALLINT')
+    , ('i94addr', 'i94addr', 'TEXT')
+    , ('i94bir', 'i94bir', 'SMALLINT')
+    , ('i94visa', 'i94visa', 'SMALLINT')
+    , ('count', 'count', 'SMALLINT')
+    , ('visapost', 'visapost', 'TEXT')
+    , ('occup', 'occup', 'TEXT')
+    , ('biryear', 'biryear', 'SMALLINT')
+    , ('dtaddto', 'dtaddto', 'TEXT')
+    , ('gender', 'gender', 'TEXT')
+    , ('airline', 'airline', 'TEXT')
+    , ('visatype', 'visatype', 'TEXT')
+    , ('arrvl_dt', 'arrdate', 'DATE')
+    , ('dep_dt', 'depdate', 'DATE')
+]
+
+imgrtn_stg_col_lst = [stg_col for stg_col, src_col, data_type in imgrtn_stg_col]
+imgrtn_src_col_lst = [src_col for stg_col, src_col, data_type in imgrtn_stg_col]
+
 imgrtn_data_stg_tbl_create = ("""
     CREATE TABLE IF NOT EXISTS imgrtn_data_stg
     (
-        cicid NUMERIC PRIMARY KEY
-        ,i94yr NUMERIC
-        ,i94mon NUMERIC
-        ,i94cit NUMERIC
-        ,i94res NUMERIC
-        ,i94port TEXT
-        ,i94mode NUMERIC
-        ,i94addr TEXT
-        ,i94bir NUMERIC
-        ,i94visa NUMERIC
-        ,count NUMERIC
-        ,visapost TEXT
-        ,occup TEXT
-        ,biryear NUMERIC
-        ,dtaddto TEXT
-        ,gender TEXT
-        ,airline TEXT
-        ,visatype TEXT
-        ,arrvl_dt TEXT
-        ,dep_dt TEXT
+        {}
     )
-""")
+""").format('\n        ,'.join('{} {}'.format(stg_col, data_type)
+                                for stg_col, src_col, data_type
+                                in imgrtn_stg_col))
+
+################################################################################
+# Pre-aggregated immigration staging table columns. The cleaning script can sum
+# the immigrant count by these keys, the grain of the fact table, instead of
+# writing every I-94 record. The source columns keep their staging names so
+# that the dimension and fact loads can read either staging table.
+################################################################################
+
+imgrtn_agg_stg_col = [
+      ('arrvl_yr_mnth', 'INT')
+    , ('i94cit', 'SMALLINT')
+    , ('i94res', 'SMALLINT')
+    , ('i94port', 'TEXT')
+    , ('i94mode', 'SMALLINT')
+    , ('i94addr', 'TEXT')
+    , ('i94visa', 'SMALLINT')
+    , ('count', 'INT')
+]
+
+imgrtn_agg_stg_col_lst = [stg_col for stg_col, data_type in imgrtn_agg_stg_col]
+
+imgrtn_agg_stg_tbl_create = ("""
+    CREATE TABLE IF NOT EXISTS imgrtn_agg_stg
+    (
+        {}
+    )
+""").format('\n        ,'.join('{} {}'.format(stg_col, data_type)
+                                for stg_col, data_type in imgrtn_agg_stg_col))
 
 city_demogrphc_dim_tbl_create = ("""
     CREATE TABLE IF NOT EXISTS city_demogrphc_dim
@@ -288,59 +334,172 @@ misc_data_bucket = config['S3']['s3_misc_data']
 
 iam_role_nm=config['IAM_ROLE']['ARN']
 
+# COPY compression keyword of each compressed file name suffix
+copy_codec_kw = {'.gz': 'gzip', '.zst': 'zstd', '.bz2': 'bzip2'}
+
+def get_copy_codec(f_nm):
+    """
+    Return the COPY compression keyword matching the suffix of a file name.
+
+    Args:
+        (str) f_nm - data file name
+
+    Returns:
+        (str) codec_kw - compression keyword followed by a space, or an empty
+                         string for an uncompressed file
+    """
+
+    f_nm_sfx = f_nm[f_nm.rfind('.'):]
+    if f_nm_sfx in copy_codec_kw:
+        return copy_codec_kw[f_nm_sfx] + ' '
+
+    return ''
+
 cntry_stg_copy = ("""
+    BEGIN TRANSACTION;
     DELETE FROM cntry_stg;
     COPY cntry_stg FROM '{}/{}' iam_role {}
         region 'us-west-2' FORMAT CSV IGNOREHEADER 1;
+    END TRANSACTION;
 """).format(misc_data_bucket, config['S3']['country'], iam_role_nm)
 
 port_of_entry_stg_copy = ("""
+    BEGIN TRANSACTION;
     DELETE FROM port_of_entry_stg;
     COPY port_of_entry_stg FROM '{}/{}' iam_role {}
         region 'us-west-2' DELIMITER '|' IGNOREHEADER 1;
+    END TRANSACTION;
 """).format(misc_data_bucket, config['S3']['port_of_entry'], iam_role_nm)
  
 state_stg_copy = ("""
+    BEGIN TRANSACTION;
     DELETE FROM state_stg;
     COPY state_stg FROM '{}/{}' iam_role {}
         region 'us-west-2' CSV IGNOREHEADER 1;
+    END TRANSACTION;
 """).format(misc_data_bucket, config['S3']['us_state'], iam_role_nm)
 
 trans_mode_stg_copy = ("""
+    BEGIN TRANSACTION;
     DELETE FROM trans_mode_stg;
     COPY trans_mode_stg FROM '{}/{}' iam_role {}
         region 'us-west-2' CSV IGNOREHEADER 1;
+    END TRANSACTION;
 """).format(misc_data_bucket, config['S3']['transportion_mode'], iam_role_nm)
 
 visa_ctgry_stg_copy = ("""
+    BEGIN TRANSACTION;
     DELETE FROM visa_ctgry_stg;
     COPY visa_ctgry_stg FROM '{}/{}' iam_role {}
         region 'us-west-2' CSV IGNOREHEADER 1;
+    END TRANSACTION;
 """).format(misc_data_bucket, config['S3']['visa_category'], iam_role_nm)
 
 city_demogrphc_stg_copy = ("""
+    BEGIN TRANSACTION;
     DELETE FROM city_demogrphc_stg;
     COPY city_demogrphc_stg FROM '{}/{}' iam_role {}
         region 'us-west-2' DELIMITER ';' IGNOREHEADER 1;
+    END TRANSACTION;
 """).format(misc_data_bucket, config['S3']['us_city_demographic'], iam_role_nm)
 
 city_temp_stg_copy = ("""
+    BEGIN TRANSACTION;
     DELETE FROM city_temp_stg;
     COPY city_temp_stg FROM '{}/{}' iam_role {}
         region 'us-west-2' CSV IGNOREHEADER 1;
+    END TRANSACTION;
 """).format(misc_data_bucket, config['S3']['city_temp'], iam_role_nm)
   
 airport_stg_copy = ("""
+    BEGIN TRANSACTION;
     DELETE FROM airport_stg;
     COPY airport_stg FROM '{}/{}' iam_role {}
-        region 'us-west-2' gzip CSV IGNOREHEADER 1;
-""").format(misc_data_bucket, config['S3']['airport'], iam_role_nm)
+        region 'us-west-2' {}CSV IGNOREHEADER 1;
+    END TRANSACTION;
+""").format(misc_data_bucket, config['S3']['airport'], iam_role_nm,
+            get_copy_codec(config['S3']['airport']))
     
-imgrtn_data_stg_copy = ("""
-    DELETE FROM imgrtn_data_stg;
-    COPY imgrtn_data_stg FROM '{}' iam_role {}
-        region 'us-west-2' gzip CSV IGNOREHEADER 1;
-""").format(config['S3']['s3_imgrtn_data'], iam_role_nm)
+# the cleaned immigration data is written as CSV (default) or Parquet files;
+# the CSV files are compressed with gzip (default) or zstd
+imgrtn_out_fmt = config.get('CLEAN', 'out_fmt', fallback='csv')
+imgrtn_codec = config.get('CLEAN', 'codec', fallback='gzip')
+
+# the cleaning script writes either every I-94 record or records pre-aggregated
+# to the fact table grain, which are loaded into imgrtn_agg_stg
+imgrtn_pre_agg = config.getboolean('CLEAN', 'pre_agg', fallback=False)
+
+# the immigration staging tables are loaded from every object of the bucket
+# (prefix) or from exactly the objects listed in the COPY manifest written by
+# the last upload (manifest), which lists every object of the bucket as well
+imgrtn_copy_mode = config.get('ETL', 'imgrtn_copy_mode', fallback='prefix')
+
+# layout of the immigration object keys: flat or partitioned by arrival month
+# (year=2016/month=04/...), which lets the incremental load of some months
+# (set_incr_load) read only their objects
+imgrtn_key_layout = config.get('UPLOAD', 'key_layout', fallback='flat')
+
+imgrtn_stg_copy = ("""
+    COPY {} FROM '{}' iam_role {}
+        region 'us-west-2' {};""")
+
+def get_imgrtn_stg_copy(tbl_nm, yr_mnth_lst=None):
+    """
+    Compose the copy command loading an immigration staging table from every
+    object of its bucket, from the COPY manifest of the last upload, or, with
+    the partitioned key layout, from the objects of some arrival months only.
+
+    Args:
+        (str) tbl_nm - imgrtn_data_stg or imgrtn_agg_stg
+        (list) yr_mnth_lst - arrival months (YYYYMM) to load; None or empty
+                             loads every month
+
+    Returns:
+        (str) copy_cmd - delete and copy commands of the staging table in one
+                         transaction
+    """
+
+    if tbl_nm == 'imgrtn_agg_stg':
+        s3_url = config['S3']['s3_imgrtn_agg_data']
+        manifest_url = config['S3']['s3_imgrtn_agg_manifest']
+    else:
+        s3_url = config['S3']['s3_imgrtn_data']
+        manifest_url = config['S3']['s3_imgrtn_manifest']
+
+    if tbl_nm == 'imgrtn_data_stg' and imgrtn_out_fmt == 'parquet':
+        copy_fmt = 'FORMAT AS PARQUET'
+    else:
+        copy_fmt = '{} CSV IGNOREHEADER 1'.format(imgrtn_codec)
+
+    if yr_mnth_lst and imgrtn_copy_mode == 'manifest':
+        raise ValueError('loading some months needs imgrtn_copy_mode=prefix')
+    if yr_mnth_lst and imgrtn_key_layout != 'partitioned':
+        raise ValueError('loading some months needs key_layout=partitioned')
+
+    if imgrtn_copy_mode == 'manifest':
+        src_lst, copy_fmt = [manifest_url], copy_fmt + ' MANIFEST'
+    elif yr_mnth_lst:
+        src_lst = ['{}/year={}/month={}/'.format(s3_url, yr_mnth[:4],
+                                                 yr_mnth[4:])
+                   for yr_mnth in yr_mnth_lst]
+    else:
+        src_lst = [s3_url]
+
+    copy_cmd = """
+    BEGIN TRANSACTION;
+    DELETE FROM {};""".format(tbl_nm)
+    for src_url in src_lst:
+        copy_cmd += imgrtn_stg_copy.format(tbl_nm, src_url, iam_role_nm,
+                                           copy_fmt)
+    return copy_cmd + """
+    END TRANSACTION;
+"""
+
+# a full load stages every month, since it rebuilds the dimensions with
+# identity keys referenced by the fact rows of every month
+imgrtn_data_stg_copy = get_imgrtn_stg_copy('imgrtn_data_stg')
+
+imgrtn_agg_stg_copy = get_imgrtn_stg_copy('imgrtn_agg_stg')
 
 
 ################################################################################
@@ -361,6 +520,12 @@ trans_mode_dim_tbl_load = ("""
         SELECT COALESCE(i94mode::SMALLINT, 9) AS trans_mode_id 
         FROM imgrtn_data_stg
         --
+        UNION
+        --
+        -- keep the codes of the months already loaded into the fact table
+        SELECT trans_mode_id
+        FROM imgrtn_data_fct
+        --
         EXCEPT
         --
         SELECT trans_mode_id
@@ -558,6 +723,13 @@ port_of_entry_dim_tbl_load = ("""
         FROM imgrtn_data_stg 
         GROUP BY 1
         --
+        UNION
+        --
+        -- keep the codes of the months already loaded into the fact table
+        SELECT port_of_entry_cd
+        FROM imgrtn_data_fct
+        GROUP BY 1
+        --
         EXCEPT
         --
         SELECT port_of_entry_cd
@@ -850,7 +1022,7 @@ time_period_dim_tbl_load = ("""
     FROM
     (
         SELECT
-             TO_CHAR(TO_DATE(arrvl_dt,'YYYY-MM-DD'),'YYYYMM')::INT AS yr_mnth   
+             TO_CHAR(arrvl_dt, 'YYYYMM')::INT AS yr_mnth
             ,i94yr::INT AS yr
             ,i94mon::INT AS mnth
         FROM imgrtn_data_stg
@@ -892,8 +1064,7 @@ imgrtn_data_fct_tbl_load = ("""
     FROM
     (
         SELECT
-              TO_CHAR(TO_DATE(arrvl_dt ,'YYYY-MM-DD')
-                        ,'YYYYMM')::INT AS arrvl_yr_mnth 
+              TO_CHAR(arrvl_dt, 'YYYYMM')::INT AS arrvl_yr_mnth
             , CASE
                 WHEN i94cit::SMALLINT = 353 THEN 311
                 WHEN i94cit::SMALLINT = 721 THEN 741
@@ -1128,68 +1299,171 @@ imgrtn_data_fct_tbl_load = ("""
 
 
 ################################################################################
-# Compose data quality queries
+# Compose the loads reading the pre-aggregated immigration staging table. Its
+# columns keep the staging names, so the transportation mode, port of entry and
+# fact loads only differ in the table read and the arrival month, which is
+# already computed.
 ################################################################################
 
-imgrtn_total = ("""
-    SELECT SUM(imgrnt_cnt) FROM imgrtn_data_fct;
-""")
+trans_mode_dim_agg_tbl_load = trans_mode_dim_tbl_load. \
+    replace('FROM imgrtn_data_stg', 'FROM imgrtn_agg_stg')
 
-imgrtn_airport_total = ("""
-    SELECT SUM(imgrnt_cnt)
-    FROM imgrtn_data_fct fct
-    INNER JOIN airport_dim dim
-        on dim.airport_id = fct.airport_id;
-""")
+port_of_entry_dim_agg_tbl_load = port_of_entry_dim_tbl_load. \
+    replace('FROM imgrtn_data_stg', 'FROM imgrtn_agg_stg')
 
-imgrtn_tm_period_total = ("""
-    SELECT SUM(imgrnt_cnt)
-    FROM imgrtn_data_fct fct
-    INNER JOIN time_period_dim dim
-        on dim.yr_mnth = fct.arrvl_yr_mnth;
-""")
+imgrtn_data_fct_agg_tbl_load = imgrtn_data_fct_tbl_load. \
+    replace("TO_CHAR(arrvl_dt, 'YYYYMM')::INT AS arrvl_yr_mnth",
+            "arrvl_yr_mnth"). \
+    replace('FROM imgrtn_data_stg', 'FROM imgrtn_agg_stg')
 
-imgrtn_port_of_entry_total = ("""
-    SELECT SUM(imgrnt_cnt)
-    FROM imgrtn_data_fct fct
-    INNER JOIN port_of_entry_dim dim
-        on dim.port_of_entry_cd = fct.port_of_entry_cd;
-""")
+time_period_dim_agg_tbl_load = ("""
+    BEGIN TRANSACTION;
+    DELETE FROM time_period_dim
+    USING
+    (
+        SELECT arrvl_yr_mnth AS yr_mnth
+        FROM imgrtn_agg_stg
+        GROUP BY 1
+    ) time_period
+    WHERE time_period_dim.yr_mnth = time_period.yr_mnth;
 
-imgrtn_trans_mode_total = ("""  
-    SELECT SUM(imgrnt_cnt)
-    FROM imgrtn_data_fct fct
-    INNER JOIN trans_mode_dim dim
-        on dim.trans_mode_id = fct.trans_mode_id;
-""")
-   
-imgrtn_visa_ctgry_total = ("""  
-    SELECT SUM(imgrnt_cnt)
-    FROM imgrtn_data_fct fct
-    INNER JOIN state_dim dim
-        on dim.state_cd = fct.dest_state_cd;
+    INSERT INTO time_period_dim(yr_mnth, yr, mnth, mnth_shrt_nm, mnth_lng_nm
+                                , yr_mnth_nm, qtr, yr_qtr_nm)
+    SELECT
+         yr_mnth, yr_mnth / 100 AS yr, yr_mnth % 100 AS mnth
+         ,TO_CHAR(TO_DATE(yr_mnth || '01', 'YYYYMMDD'), 'Mon') mnth_shrt_nm
+         ,TO_CHAR(TO_DATE(yr_mnth || '01', 'YYYYMMDD'), 'Month') mnth_long_nm
+         ,TO_CHAR(TO_DATE(yr_mnth || '01', 'YYYYMMDD'), 'YYYY-Mon') yr_mnth_nm
+         ,TO_CHAR(TO_DATE(yr_mnth || '01', 'YYYYMMDD'), 'Q')::INT qtr
+         ,TO_CHAR(TO_DATE(yr_mnth || '01', 'YYYYMMDD'), 'YYYY-"Q"Q') yr_qtr_nm
+    FROM
+    (
+        SELECT arrvl_yr_mnth AS yr_mnth
+        FROM imgrtn_agg_stg
+        GROUP BY 1
+    ) time_period
+    ;
+    END TRANSACTION;
 """)
 
-imgrtn_state_total = ("""  
-    SELECT SUM(imgrnt_cnt)
-    FROM imgrtn_data_fct fct
-    INNER JOIN visa_ctgry_dim dim
-        on dim.visa_ctgry_id = fct.visa_ctgry_id;
-""")
 
-imgrtn_city_demogrphc_total = ("""    
-    SELECT SUM(imgrnt_cnt)
-    FROM imgrtn_data_fct fct
-    INNER JOIN city_demogrphc_dim dim
-        on dim.city_demogrphc_id = fct.city_demogrphc_id;
-""")
+################################################################################
+# Compose data quality queries. Every immigrant of the fact table must match a
+# record of each dimension, so each fact joined to dimension total must equal
+# the fact total. All totals are summed in one scan of the fact table, left
+# joined to the distinct keys of each dimension.
+################################################################################
+
+# dimension table, dimension key and fact table key of each total
+data_quality_dim = {
+      'imgrtn_airport_total': {
+        'dim_tbl': 'airport_dim', 'dim_key': 'airport_id'
+        , 'fct_key': 'airport_id'}
+    , 'imgrtn_tm_period_total': {
+        'dim_tbl': 'time_period_dim', 'dim_key': 'yr_mnth'
+        , 'fct_key': 'arrvl_yr_mnth'}
+    , 'imgrtn_port_of_entry_total': {
+        'dim_tbl': 'port_of_entry_dim', 'dim_key': 'port_of_entry_cd'
+        , 'fct_key': 'port_of_entry_cd'}
+    , 'imgrtn_trans_mode_total': {
+        'dim_tbl': 'trans_mode_dim', 'dim_key': 'trans_mode_id'
+        , 'fct_key': 'trans_mode_id'}
+    , 'imgrtn_visa_ctgry_total': {
+        'dim_tbl': 'visa_ctgry_dim', 'dim_key': 'visa_ctgry_id'
+        , 'fct_key': 'visa_ctgry_id'}
+    , 'imgrtn_state_total': {
+        'dim_tbl': 'state_dim', 'dim_key': 'state_cd'
+        , 'fct_key': 'dest_state_cd'}
+    , 'imgrtn_city_demogrphc_total': {
+        'dim_tbl': 'city_demogrphc_dim', 'dim_key': 'city_demogrphc_id'
+        , 'fct_key': 'city_demogrphc_id'}
+    , 'imgrtn_city_temp_total': {
+        'dim_tbl': 'city_temp_dim', 'dim_key': 'city_temp_id'
+        , 'fct_key': 'city_temp_id'}
+}
 
-imgrtn_city_temp_total = ("""  
-    SELECT SUM(imgrnt_cnt)
+def get_data_quality_qry():
+    """
+    Compose the query returning the fact total followed by the fact joined to
+    dimension total of each entry of data_quality_dim, in one scan of the fact
+    table, and then the number of duplicate keys of each dimension. Fact
+    records without a matching dimension key, including null keys, are left
+    out of the total of that dimension. The fact is joined to the distinct
+    dimension keys, so duplicate keys do not inflate the totals and are
+    counted apart instead.
+
+    Returns:
+        (str) query - data quality query
+    """
+
+    sum_lst = ['SUM(fct.imgrnt_cnt) AS imgrtn_total']
+    join_lst = []
+    dup_col_lst, dup_join_lst = [], []
+    for data_qlty_nm, dim in data_quality_dim.items():
+        dim_alias = dim['dim_tbl']
+        sum_lst.append(
+            'SUM(CASE WHEN {0}.{1} IS NOT NULL THEN fct.imgrnt_cnt ELSE 0 END)'
+            ' AS {2}'.format(dim_alias, dim['dim_key'], data_qlty_nm))
+        join_lst.append(
+            'LEFT JOIN (SELECT DISTINCT {1} FROM {0}) {0}\n'
+            '            ON {0}.{1} = fct.{2}'.format(dim['dim_tbl'],
+                                                     dim['dim_key'],
+                                                     dim['fct_key']))
+        dup_col_lst.append('{}_dup.dup_key_cnt'.format(dim['dim_tbl']))
+        dup_join_lst.append(
+            'CROSS JOIN (SELECT COUNT({1}) - COUNT(DISTINCT {1}) AS dup_key_cnt'
+            '\n        FROM {0}) {0}_dup'.format(dim['dim_tbl'],
+                                               dim['dim_key']))
+
+    return """
+    SELECT tot.*
+        , {}
+    FROM (
+        SELECT {}
+        FROM imgrtn_data_fct fct
+        {}
+    ) tot
+    {};
+""".format('\n        , '.join(dup_col_lst),
+           '\n            , '.join(sum_lst), '\n        '.join(join_lst),
+           '\n    '.join(dup_join_lst))
+
+def get_missing_key_qry(data_qlty_nm, key_limit=20):
+    """
+    Compose the query listing the fact table keys without a record in the
+    dimension of a data quality total, with their immigrant and fact record
+    counts, largest first.
+
+    Args:
+        (str) data_qlty_nm - data quality total name of data_quality_dim
+        (int) key_limit - maximum number of keys listed
+
+    Returns:
+        (str) query - missing dimension keys query
+    """
+
+    dim = data_quality_dim[data_qlty_nm]
+    return """
+    SELECT fct.{2}, SUM(fct.imgrnt_cnt), COUNT(*)
     FROM imgrtn_data_fct fct
-    INNER JOIN city_temp_dim dim
-        on dim.city_temp_id = fct.city_temp_id;
-""")        
+    LEFT JOIN (SELECT DISTINCT {1} FROM {0}) dim
+        ON dim.{1} = fct.{2}
+    WHERE dim.{1} IS NULL
+    GROUP BY 1
+    ORDER BY 2 DESC
+    LIMIT {3};
+""".format(dim['dim_tbl'], dim['dim_key'], dim['fct_key'], key_limit)
+
+data_quality_qry = get_data_quality_qry()
+
+
+################################################################################
+# Compose load metadata queries, which count the records copied without
+# scanning the loaded table
+################################################################################
+copy_rowcount_qry = "SELECT pg_last_copy_count();"
+
+last_qry_id_qry = "SELECT pg_last_query_id();"
 
        
 ################################################################################
@@ -1207,6 +1481,7 @@ drop_tbl_qry = {
     , 'city_temp_stg': city_temp_stg_tbl_drop
     , 'airport_stg': airport_stg_tbl_drop
     , 'imgrtn_data_stg': imgrtn_data_stg_tbl_drop
+    , 'imgrtn_agg_stg': imgrtn_agg_stg_tbl_drop
     , 'port_of_entry_dim': port_of_entry_dim_tbl_drop
     , 'trans_mode_dim': trans_mode_dim_tbl_drop
     , 'visa_ctgry_dim': visa_ctgry_dim_tbl_drop
@@ -1228,6 +1503,7 @@ create_tbl_qry = {
     , 'city_temp_stg': city_temp_stg_tbl_create
     , 'airport_stg': airport_stg_tbl_create
     , 'imgrtn_data_stg': imgrtn_data_stg_tbl_create
+    , 'imgrtn_agg_stg': imgrtn_agg_stg_tbl_create
     , 'city_demogrphc_dim': city_demogrphc_dim_tbl_create
     , 'port_of_entry_dim': port_of_entry_dim_tbl_create
     , 'trans_mode_dim': trans_mode_dim_tbl_create
@@ -1265,20 +1541,97 @@ load_tgt_tbl_qry = {
     , 'imgrtn_data_fct': imgrtn_data_fct_tbl_load
 }
 
-data_quality_qry = {
-      'imgrtn_total': imgrtn_total
-    , 'imgrtn_airport_total': imgrtn_airport_total
-    , 'imgrtn_tm_period_total': imgrtn_tm_period_total
-    , 'imgrtn_port_of_entry_total': imgrtn_port_of_entry_total
-    , 'imgrtn_trans_mode_total': imgrtn_trans_mode_total
-    , 'imgrtn_visa_ctgry_total': imgrtn_visa_ctgry_total
-    , 'imgrtn_state_total': imgrtn_state_total
-    , 'imgrtn_city_demogrphc_total': imgrtn_city_demogrphc_total
-    , 'imgrtn_city_temp_total': imgrtn_city_temp_total
+# tables read and written by each target table load; a load starts only after
+# the loads writing the tables it reads have finished. The transportation mode
+# and port of entry loads also read the codes of the fact rows loaded by earlier
+# runs, which the fact load only replaces after them, so it is not declared.
+load_tgt_tbl_dep = {
+    'trans_mode_dim': {
+        'reads': ['trans_mode_stg', 'imgrtn_data_stg']
+        , 'writes': ['trans_mode_dim']}
+    , 'visa_ctgry_dim': {
+        'reads': ['visa_ctgry_stg']
+        , 'writes': ['visa_ctgry_dim']}
+    , 'cntry_dim': {
+        'reads': ['cntry_stg']
+        , 'writes': ['cntry_dim']}
+    , 'state_dim': {
+        'reads': ['state_stg']
+        , 'writes': ['state_dim']}
+    , 'port_of_entry_dim': {
+        'reads': ['port_of_entry_stg', 'state_stg', 'imgrtn_data_stg'
+                  , 'port_of_entry_dim']
+        , 'writes': ['port_of_entry_dim']}
+    , 'city_demogrphc_dim': {
+        'reads': ['city_demogrphc_stg']
+        , 'writes': ['city_demogrphc_dim']}
+    , 'city_temp_dim': {
+        'reads': ['city_temp_stg']
+        , 'writes': ['city_temp_dim']}
+    , 'airport_dim': {
+        'reads': ['airport_stg', 'state_stg']
+        , 'writes': ['airport_dim']}
+    , 'time_period_dim': {
+        'reads': ['imgrtn_data_stg']
+        , 'writes': ['time_period_dim']}
+    , 'imgrtn_data_fct': {
+        'reads': ['imgrtn_data_stg', 'state_stg', 'port_of_entry_dim'
+                  , 'trans_mode_dim', 'airport_dim', 'city_demogrphc_dim'
+                  , 'city_temp_dim']
+        , 'writes': ['imgrtn_data_fct']}
 }
 
 
 
 
 
+
                        
+
+# load the pre-aggregated immigration staging table and the loads reading it
+# when the cleaning script pre-aggregates the immigration data
+if imgrtn_pre_agg:
+    del load_stg_tbl_qry['imgrtn_data_stg']
+    load_stg_tbl_qry['imgrtn_agg_stg'] = imgrtn_agg_stg_copy
+
+    load_tgt_tbl_qry['trans_mode_dim'] = trans_mode_dim_agg_tbl_load
+    load_tgt_tbl_qry['port_of_entry_dim'] = port_of_entry_dim_agg_tbl_load
+    load_tgt_tbl_qry['time_period_dim'] = time_period_dim_agg_tbl_load
+    load_tgt_tbl_qry['imgrtn_data_fct'] = imgrtn_data_fct_agg_tbl_load
+    for tbl_dep in load_tgt_tbl_dep.values():
+        tbl_dep['reads'] = ['imgrtn_agg_stg' if tbl_nm == 'imgrtn_data_stg'
+                            else tbl_nm for tbl_nm in tbl_dep['reads']]
+
+
+# target tables rebuilt by an incremental load of some arrival months; the
+# other dimensions have identity keys referenced by the fact rows of earlier
+# months, so they are kept as loaded by the last full load
+incr_load_tgt_tbl_lst = ['trans_mode_dim', 'port_of_entry_dim',
+                         'time_period_dim', 'imgrtn_data_fct']
+
+def set_incr_load(yr_mnth_lst):
+    """
+    Narrow the staging and target table loads to an incremental load of some
+    arrival months. Only the immigration staging table is loaded, from the
+    objects of those months, and only the tables of incr_load_tgt_tbl_lst are
+    rebuilt; the fact load replaces the rows of the staged months only. The
+    other staging and dimension tables are kept as loaded by the last full
+    load.
+
+    Args:
+        (list) yr_mnth_lst - arrival months (YYYYMM) to load
+
+    Raises:
+        ValueError - the bucket layout or copy mode cannot load some months
+    """
+
+    imgrtn_stg_tbl_nm = 'imgrtn_agg_stg' if imgrtn_pre_agg \
+                        else 'imgrtn_data_stg'
+    imgrtn_stg_copy_cmd = get_imgrtn_stg_copy(imgrtn_stg_tbl_nm, yr_mnth_lst)
+
+    load_stg_tbl_qry.clear()
+    load_stg_tbl_qry[imgrtn_stg_tbl_nm] = imgrtn_stg_copy_cmd
+
+    for tbl_nm in list(load_tgt_tbl_qry):
+        if tbl_nm not in incr_load_tgt_tbl_lst:
+            del load_tgt_tbl_qry[tbl_nm]
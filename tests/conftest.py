@@ -0,0 +1,8 @@
+import os
+import sys
+
+# the scripts import each other from the application directory and read
+# dwh.cfg from the working directory when imported
+app_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, app_dir)
+os.chdir(app_dir)
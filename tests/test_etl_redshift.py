@@ -0,0 +1,111 @@
+import os
+from etl_redshift import split_sql_stmt, group_sql_stmt, get_stmt_verb
+from etl_redshift import open_load_checkpoint, get_done_grp_cnt
+from etl_redshift import set_done_grp_cnt
+from sql_redshift_qry import load_stg_tbl_qry
+
+
+def test_split_ignores_semicolon_in_string_literal():
+    stmt_lst = split_sql_stmt("""
+        INSERT INTO t VALUES ('a;b', 'it''s; here');
+        DELETE FROM t WHERE c = 'x;';
+    """)
+
+    assert stmt_lst == ["INSERT INTO t VALUES ('a;b', 'it''s; here')",
+                        "DELETE FROM t WHERE c = 'x;'"]
+
+
+def test_split_ignores_semicolon_in_quoted_identifier():
+    stmt_lst = split_sql_stmt('SELECT 1 AS "a;b"; SELECT 2')
+
+    assert stmt_lst == ['SELECT 1 AS "a;b"', 'SELECT 2']
+
+
+def test_split_removes_comments_with_semicolons():
+    stmt_lst = split_sql_stmt("""
+        -- load t; then u
+        INSERT INTO t SELECT 1; /* not; a statement */
+        /* multi
+           line; comment */
+        INSERT INTO u SELECT 2 -- trailing; comment
+        ;
+    """)
+
+    assert [get_stmt_verb(stmt) for stmt in stmt_lst] == ['INSERT', 'INSERT']
+    assert stmt_lst[0] == 'INSERT INTO t SELECT 1'
+    assert stmt_lst[1] == 'INSERT INTO u SELECT 2'
+
+
+def test_split_keeps_statement_order_and_drops_blank_ones():
+    stmt_lst = split_sql_stmt('SELECT 1;;  ; SELECT 2; SELECT 3')
+
+    assert stmt_lst == ['SELECT 1', 'SELECT 2', 'SELECT 3']
+
+
+def test_group_transaction_is_one_group():
+    stmt_lst = split_sql_stmt("""
+        DELETE FROM a;
+        BEGIN TRANSACTION;
+        DELETE FROM b;
+        INSERT INTO b SELECT 1;
+        END TRANSACTION;
+        INSERT INTO c SELECT 2;
+    """)
+
+    assert [[get_stmt_verb(stmt) for stmt in stmt_grp]
+            for stmt_grp in group_sql_stmt(stmt_lst)] == \
+        [['DELETE'], ['BEGIN', 'DELETE', 'INSERT', 'END'], ['INSERT']]
+
+
+def test_group_temp_table_load_is_one_group():
+    stmt_lst = split_sql_stmt("""
+        CREATE TEMP TABLE a_tmp AS SELECT 1 AS x;
+        BEGIN TRANSACTION;
+        DELETE FROM a;
+        INSERT INTO a SELECT x FROM a_tmp;
+        END TRANSACTION;
+        DROP TABLE a_tmp;
+    """)
+
+    assert group_sql_stmt(stmt_lst) == [stmt_lst]
+
+
+def test_group_staging_loads_are_atomic():
+    for tbl_nm, query in load_stg_tbl_qry.items():
+        stmt_grp_lst = group_sql_stmt(split_sql_stmt(query))
+
+        assert len(stmt_grp_lst) == 1, tbl_nm
+        assert get_stmt_verb(stmt_grp_lst[0][0]) == 'BEGIN', tbl_nm
+        assert get_stmt_verb(stmt_grp_lst[0][-1]) == 'END', tbl_nm
+
+
+def test_checkpoint_resumes_completed_groups(tmp_path):
+    chkpt_path = str(tmp_path / 'etl_checkpoint.json')
+    chkpt = open_load_checkpoint(chkpt_path, False)
+    set_done_grp_cnt(chkpt, 'target:a', 'INSERT INTO a SELECT 1;', 2)
+
+    chkpt = open_load_checkpoint(chkpt_path, True)
+
+    assert get_done_grp_cnt(chkpt, 'target:a', 'INSERT INTO a SELECT 1;') == 2
+    assert get_done_grp_cnt(chkpt, 'target:b', 'INSERT INTO b SELECT 1;') == 0
+
+
+def test_checkpoint_mismatch_after_query_change(tmp_path):
+    chkpt_path = str(tmp_path / 'etl_checkpoint.json')
+    chkpt = open_load_checkpoint(chkpt_path, False)
+    set_done_grp_cnt(chkpt, 'target:a', 'INSERT INTO a SELECT 1;', 2)
+
+    chkpt = open_load_checkpoint(chkpt_path, True)
+
+    assert get_done_grp_cnt(chkpt, 'target:a', 'INSERT INTO a SELECT 2;') == 0
+
+
+def test_checkpoint_discarded_without_resume(tmp_path):
+    chkpt_path = str(tmp_path / 'etl_checkpoint.json')
+    chkpt = open_load_checkpoint(chkpt_path, False)
+    set_done_grp_cnt(chkpt, 'target:a', 'INSERT INTO a SELECT 1;', 2)
+
+    chkpt = open_load_checkpoint(chkpt_path, False)
+
+    assert not os.path.exists(chkpt_path)
+    assert get_done_grp_cnt(chkpt, 'target:a', 'INSERT INTO a SELECT 1;') == 0
@@ -0,0 +1,114 @@
+import pytest
+from botocore.exceptions import ClientError
+from upload_file_to_aws import S3MultipartWriter, s3_min_part_size
+
+
+class StubS3:
+    """
+    Stands in for the AWS S3 client, recording the upload requests and
+    failing the part upload or the completion when asked to.
+    """
+
+    def __init__(self, fail_part_nbr=None, fail_complete=False):
+        self.fail_part_nbr = fail_part_nbr
+        self.fail_complete = fail_complete
+        self.call_lst = []
+
+    def fail(self, operation_nm):
+        return ClientError({'Error': {'Code': 'InternalError'
+                                      , 'Message': 'stub failure'}},
+                           operation_nm)
+
+    def create_multipart_upload(self, Bucket, Key):
+        self.call_lst.append(('create', Key))
+        return {'UploadId': 'upload-1'}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        if PartNumber == self.fail_part_nbr:
+            raise self.fail('UploadPart')
+        self.call_lst.append(('part', PartNumber, len(Body)))
+        return {'ETag': '"etag-{}"'.format(PartNumber)}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId,
+                                  MultipartUpload):
+        if self.fail_complete:
+            raise self.fail('CompleteMultipartUpload')
+        self.call_lst.append(('complete', MultipartUpload['Parts']))
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.call_lst.append(('abort', UploadId))
+
+    def put_object(self, Bucket, Key, Body):
+        self.call_lst.append(('put', len(Body)))
+
+
+def write_blocks(dest_f, byte_cnt, block_size=2**20):
+    for block_pos in range(0, byte_cnt, block_size):
+        dest_f.write(b'x' * min(block_size, byte_cnt - block_pos))
+
+
+def test_parts_of_part_size_and_short_last_part():
+    s3 = StubS3()
+    dest_f = S3MultipartWriter(s3, 'bucket', 'key', s3_min_part_size)
+    write_blocks(dest_f, 2 * s3_min_part_size + 3 * 2**20)
+    dest_f.close()
+
+    assert s3.call_lst == [
+        ('create', 'key')
+        , ('part', 1, s3_min_part_size)
+        , ('part', 2, s3_min_part_size)
+        , ('part', 3, 3 * 2**20)
+        , ('complete', [{'PartNumber': nbr, 'ETag': '"etag-{}"'.format(nbr)}
+                        for nbr in range(1, 4)])]
+    assert dest_f.pos == 2 * s3_min_part_size + 3 * 2**20
+
+
+def test_part_size_raised_to_s3_minimum():
+    s3 = StubS3()
+    dest_f = S3MultipartWriter(s3, 'bucket', 'key', 2**20)
+    write_blocks(dest_f, s3_min_part_size + 1)
+    dest_f.close()
+
+    assert [call for call in s3.call_lst if call[0] == 'part'] == \
+        [('part', 1, s3_min_part_size), ('part', 2, 1)]
+
+
+def test_file_smaller_than_a_part_is_put_once():
+    s3 = StubS3()
+    dest_f = S3MultipartWriter(s3, 'bucket', 'key', s3_min_part_size)
+    dest_f.write(b'header\n')
+    dest_f.close()
+
+    assert s3.call_lst == [('put', 7)]
+
+
+def test_abort_after_failed_part_upload():
+    s3 = StubS3(fail_part_nbr=2)
+    dest_f = S3MultipartWriter(s3, 'bucket', 'key', s3_min_part_size)
+    with pytest.raises(ClientError):
+        write_blocks(dest_f, 3 * s3_min_part_size)
+    dest_f.abort()
+
+    assert s3.call_lst[-1] == ('abort', 'upload-1')
+    assert not any(call[0] == 'complete' for call in s3.call_lst)
+    assert dest_f.closed
+
+
+def test_abort_when_completion_fails():
+    s3 = StubS3(fail_complete=True)
+    dest_f = S3MultipartWriter(s3, 'bucket', 'key', s3_min_part_size)
+    write_blocks(dest_f, s3_min_part_size + 2**20)
+    with pytest.raises(ClientError):
+        dest_f.close()
+
+    assert s3.call_lst[-1] == ('abort', 'upload-1')
+    assert dest_f.closed
+
+
+def test_abort_when_not_closed():
+    s3 = StubS3()
+    dest_f = S3MultipartWriter(s3, 'bucket', 'key', s3_min_part_size)
+    write_blocks(dest_f, s3_min_part_size)
+    del dest_f
+
+    assert s3.call_lst[-1] == ('abort', 'upload-1')
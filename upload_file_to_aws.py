@@ -1,46 +1,678 @@
 import configparser
 import os
+import io
+import re
+import json
+import hashlib
 import boto3
-from botocore.exceptions import NoCredentialsError
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import NoCredentialsError, ClientError, BotoCoreError
+from boto3.exceptions import S3UploadFailedError
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import datetime as dt
+from run_report import RunReport, write_run_report
 
-def upload_to_aws(aws_access_key, aws_secret_key, src_dir, s3_bucket_nm):
+# smallest multipart upload part and largest number of parts allowed by S3
+s3_min_part_size = 5 * 2**20
+s3_max_part_cnt = 10000
+
+# bytes read at a time while computing file checksums
+digest_block_size = 2**20
+
+# month and year of an immigration file name such as i94_apr16_sub
+imgrtn_f_nm_pattern = re.compile(r'i94_([a-z]{3})(\d{2})_sub')
+mnth_abbr_lst = ['jan', 'feb', 'mar', 'apr', 'may', 'jun'
+                 , 'jul', 'aug', 'sep', 'oct', 'nov', 'dec']
+
+def get_upload_opt(config):
     """
-    Upload data files with a directory to AWS S3.
-    
+    Obtain the AWS S3 upload options from the UPLOAD section of the data
+    warehouse configuration, using defaults for missing options. The AWS keys
+    are included so that worker processes can open their own client.
+
+    Args:
+        (ConfigParser) config - parsed data warehouse configuration file
+
+    Returns:
+        (dict) upload_opt - upload options
+    """
+
+    return {
+        'upload_workers': config.getint('UPLOAD', 'upload_workers',
+                                        fallback=1)
+        , 'multipart_chunk_mb': config.getint('UPLOAD', 'multipart_chunk_mb',
+                                              fallback=8)
+        , 'max_concurrency': config.getint('UPLOAD', 'max_concurrency',
+                                           fallback=10)
+        , 'fail_fast': config.getboolean('UPLOAD', 'fail_fast', fallback=True)
+        , 'sync': config.getboolean('UPLOAD', 'sync', fallback=False)
+        , 'endpoint_url': config.get('UPLOAD', 's3_endpoint_url', fallback='')
+        , 'key_layout': config.get('UPLOAD', 'key_layout', fallback='flat')
+        , 'aws_access_key': config['AWS_KEY']['ACCESS_KEY']
+        , 'aws_secret_key': config['AWS_KEY']['SECRET_KEY']
+    }
+
+
+def open_s3_client(upload_opt):
+    """
+    Create the AWS S3 client shared by every upload. Its connection pool is
+    sized for all the files and file parts that can be sent at the same time.
+    An endpoint URL points the client at an S3 compatible service instead.
+
     Args:
-        (str) aws_access_key - AWS access key
-        (str) aws_secret_key - AWS secret key
+        (dict) upload_opt - upload options returned by get_upload_opt()
+
+    Returns:
+        (S3.Client) s3 - AWS S3 client
+    """
+
+    max_conn = upload_opt['upload_workers'] * upload_opt['max_concurrency']
+    return boto3.client('s3',
+                        aws_access_key_id=upload_opt['aws_access_key'],
+                        aws_secret_access_key=upload_opt['aws_secret_key'],
+                        endpoint_url=upload_opt['endpoint_url'] or None,
+                        config=Config(max_pool_connections=max(max_conn, 10)))
+
+
+def get_transfer_config(upload_opt):
+    """
+    Build the multipart transfer settings of a single file upload.
+
+    Args:
+        (dict) upload_opt - upload options returned by get_upload_opt()
+
+    Returns:
+        (TransferConfig) transfer_cfg - multipart transfer settings
+    """
+
+    chunk_size = upload_opt['multipart_chunk_mb'] * 2**20
+    return TransferConfig(multipart_threshold=chunk_size,
+                          multipart_chunksize=chunk_size,
+                          max_concurrency=upload_opt['max_concurrency'],
+                          use_threads=True)
+
+
+def list_s3_objects(s3, s3_bucket_nm):
+    """
+    List the size and ETag of every object in an AWS S3 bucket in a single
+    paginated pass.
+
+    Args:
+        (S3.Client) s3 - AWS S3 client
+        (str) s3_bucket_nm - AWS S3 bucket name
+
+    Returns:
+        (dict) s3_obj_dict - size and ETag of each object by object key
+    """
+
+    s3_obj_dict = {}
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=s3_bucket_nm):
+        for s3_obj in page.get('Contents', []):
+            s3_obj_dict[s3_obj['Key']] = {'size': s3_obj['Size']
+                                          , 'etag': s3_obj['ETag'].strip('"')}
+
+    return s3_obj_dict
+
+
+def get_part_size(f_size, transfer_cfg):
+    """
+    Obtain the multipart upload part size of a file, adjusting the configured
+    chunk size to the S3 limits the same way boto3 does.
+
+    Args:
+        (int) f_size - file size in bytes
+        (TransferConfig) transfer_cfg - multipart transfer settings
+
+    Returns:
+        (int) part_size - part size in bytes
+    """
+
+    part_size = max(transfer_cfg.multipart_chunksize, s3_min_part_size)
+    while -(-f_size // part_size) > s3_max_part_cnt:
+        part_size *= 2
+
+    return part_size
+
+
+def calc_file_digest(src_f_path, f_size, transfer_cfg):
+    """
+    Compute, in one read of the file, the ETag S3 gives the object when the
+    file is uploaded with the transfer settings, and the SHA-256 hash of the
+    file. A multipart ETag is the MD5 hash of the part MD5 hashes followed by
+    the number of parts.
+
+    Args:
+        (str) src_f_path - source file path
+        (int) f_size - file size in bytes
+        (TransferConfig) transfer_cfg - multipart transfer settings
+
+    Returns:
+        (tuple) etag, sha256 - expected ETag and SHA-256 hex digest
+    """
+
+    sha256 = hashlib.sha256()
+    if f_size < transfer_cfg.multipart_threshold:
+        md5 = hashlib.md5()
+        with open(src_f_path, 'rb') as src_f:
+            for block in iter(lambda: src_f.read(digest_block_size), b''):
+                md5.update(block)
+                sha256.update(block)
+        return md5.hexdigest(), sha256.hexdigest()
+
+    part_size = get_part_size(f_size, transfer_cfg)
+    part_md5_lst = []
+    with open(src_f_path, 'rb') as src_f:
+        for part in iter(lambda: src_f.read(part_size), b''):
+            part_md5_lst.append(hashlib.md5(part).digest())
+            sha256.update(part)
+
+    etag = '{}-{}'.format(hashlib.md5(b''.join(part_md5_lst)).hexdigest(),
+                          len(part_md5_lst))
+    return etag, sha256.hexdigest()
+
+
+def is_s3_object_current(s3, src_f_path, s3_bucket_nm, s3_key, s3_obj,
+                         transfer_cfg):
+    """
+    Check whether an AWS S3 object already holds the content of a local file.
+    The sizes are compared first, then the ETag expected for the local file.
+    When the ETags differ, because the object was uploaded with other
+    multipart settings or is encrypted with KMS, the SHA-256 hash stored in
+    the object metadata by a previous sync is read with a HEAD request.
+
+    Args:
+        (S3.Client) s3 - AWS S3 client
+        (str) src_f_path - source file path
+        (str) s3_bucket_nm - AWS S3 bucket name
+        (str) s3_key - AWS S3 object key
+        (dict) s3_obj - size and ETag of the object; None if it does not exist
+        (TransferConfig) transfer_cfg - multipart transfer settings
+
+    Returns:
+        (tuple) is_current, sha256 - True if the object is unchanged, and the
+                                     SHA-256 hex digest of the local file
+    """
+
+    f_size = os.path.getsize(src_f_path)
+    etag, sha256 = calc_file_digest(src_f_path, f_size, transfer_cfg)
+    if s3_obj is None or s3_obj['size'] != f_size:
+        return False, sha256
+
+    if s3_obj['etag'] == etag:
+        return True, sha256
+
+    try:
+        s3_meta = s3.head_object(Bucket=s3_bucket_nm, Key=s3_key)['Metadata']
+    except ClientError:
+        return False, sha256
+
+    return s3_meta.get('sha256') == sha256, sha256
+
+
+def get_s3_key(f_nm, key_layout):
+    """
+    Obtain the AWS S3 object key of a data file. In the partitioned layout the
+    immigration files are keyed by the arrival year and month taken from the
+    file name, e.g. i94_apr16_sub.csv.gz becomes
+    year=2016/month=04/i94_apr16_sub.csv.gz, so that a COPY can read a single
+    month. Other files keep their file name as the key.
+
+    Args:
+        (str) f_nm - data file name, or file name prefix
+        (str) key_layout - object key layout: flat or partitioned
+
+    Returns:
+        (str) s3_key - AWS S3 object key
+    """
+
+    f_nm_match = imgrtn_f_nm_pattern.match(f_nm)
+    if key_layout != 'partitioned' or f_nm_match is None:
+        return f_nm
+
+    mnth_abbr, yr = f_nm_match.groups()
+    return 'year=20{}/month={:02d}/{}'.format(
+        yr, mnth_abbr_lst.index(mnth_abbr) + 1, f_nm)
+
+
+def get_changed_files(s3, src_dir, src_f_lst, s3_bucket_nm, upload_opt,
+                      transfer_cfg):
+    """
+    Select the local files that are missing from, or differ from, the objects
+    of an AWS S3 bucket. The bucket is listed once and the local files are
+    hashed by the pool of upload threads.
+
+    Args:
+        (S3.Client) s3 - AWS S3 client
         (str) src_dir - source file directory
+        (list) src_f_lst - source file names
         (str) s3_bucket_nm - AWS S3 bucket name
+        (dict) upload_opt - upload options returned by get_upload_opt()
+        (TransferConfig) transfer_cfg - multipart transfer settings
+
+    Returns:
+        (dict) chg_f_dict - SHA-256 hex digest of each new or changed file
     """
 
-    s3 = boto3.client('s3', aws_access_key_id=aws_access_key,
-                      aws_secret_access_key=aws_secret_key)
+    s3_obj_dict = list_s3_objects(s3, s3_bucket_nm)
+    s3_key_dict = {src_f_nm: get_s3_key(src_f_nm, upload_opt['key_layout'])
+                   for src_f_nm in src_f_lst}
 
-    # Obtain the list of immigration data files
-    src_f_lst=os.listdir(src_dir)
-    for src_f_nm in src_f_lst:
-        src_f_path = src_dir + '/' + src_f_nm
-        
-        cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        print('{}: uploading: {} to AWS S3'.format(cur_ts, src_f_path))
-        try:
-            s3.upload_file(src_f_path, s3_bucket_nm, src_f_nm)
-            cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            print('{}: uploaded: {} to AWS S3'.format(cur_ts, src_f_path))
-        except FileNotFoundError:
+    chg_f_dict = {}
+    with ThreadPoolExecutor(max_workers=upload_opt['upload_workers']) \
+            as executor:
+        futures = {executor.submit(is_s3_object_current, s3,
+                                   src_dir + '/' + src_f_nm, s3_bucket_nm,
+                                   s3_key_dict[src_f_nm],
+                                   s3_obj_dict.get(s3_key_dict[src_f_nm]),
+                                   transfer_cfg): src_f_nm
+                   for src_f_nm in src_f_lst}
+        for future in as_completed(futures):
+            is_current, sha256 = future.result()
+            if not is_current:
+                chg_f_dict[futures[future]] = sha256
+
+    cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print('{}: skipping {} unchanged files; uploading {} files to bucket: {}'.
+            format(cur_ts, len(src_f_lst) - len(chg_f_dict), len(chg_f_dict),
+                   s3_bucket_nm))
+    return chg_f_dict
+
+
+def split_s3_url(s3_url):
+    """
+    Split an AWS S3 URL into its bucket name and object key.
+
+    Args:
+        (str) s3_url - AWS S3 URL such as s3://bucket/key
+
+    Returns:
+        (tuple) s3_bucket_nm, s3_key - AWS S3 bucket name and object key
+    """
+
+    s3_bucket_nm, _, s3_key = s3_url[len('s3://'):].partition('/')
+    return s3_bucket_nm, s3_key
+
+
+def delete_s3_objects(s3, s3_bucket_nm, s3_prefix):
+    """
+    Delete the objects of an AWS S3 bucket whose key starts with a prefix.
+
+    Args:
+        (S3.Client) s3 - AWS S3 client
+        (str) s3_bucket_nm - AWS S3 bucket name
+        (str) s3_prefix - object key prefix
+    """
+
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=s3_bucket_nm, Prefix=s3_prefix):
+        s3_key_lst = [{'Key': s3_obj['Key']}
+                      for s3_obj in page.get('Contents', [])]
+        if s3_key_lst:
+            s3.delete_objects(Bucket=s3_bucket_nm,
+                              Delete={'Objects': s3_key_lst, 'Quiet': True})
+
+
+def delete_stale_s3_objects(s3, s3_bucket_nm, s3_key_lst):
+    """
+    Delete the objects left in an AWS S3 bucket by earlier uploads of the
+    same data files: the objects whose file name starts with the name of an
+    uploaded file, without its extensions, in either key layout, but which
+    are not among the uploaded objects. A whole file replaced by file parts,
+    or files written with another codec, format or key layout, are then not
+    loaded by a COPY of the bucket together with the new objects.
+
+    Args:
+        (S3.Client) s3 - AWS S3 client
+        (str) s3_bucket_nm - AWS S3 bucket name
+        (list) s3_key_lst - AWS S3 object keys of the current data files
+    """
+
+    s3_key_set = set(s3_key_lst)
+    s3_prfx_set = {get_s3_key(os.path.basename(s3_key).split('.')[0],
+                              key_layout) + '.'
+                   for s3_key in s3_key_set
+                   for key_layout in ['flat', 'partitioned']}
+
+    paginator = s3.get_paginator('list_objects_v2')
+    for s3_prefix in sorted(s3_prfx_set):
+        for page in paginator.paginate(Bucket=s3_bucket_nm, Prefix=s3_prefix):
+            stale_key_lst = [{'Key': s3_obj['Key']}
+                             for s3_obj in page.get('Contents', [])
+                             if s3_obj['Key'] not in s3_key_set]
+            if not stale_key_lst:
+                continue
+
+            s3.delete_objects(Bucket=s3_bucket_nm,
+                              Delete={'Objects': stale_key_lst, 'Quiet': True})
             cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            print('{}: failed while uploading file: {} to AWS S3'.\
-                format(cur_ts, src_f_path))
-            return(1)
-        except NoCredentialsError:
-            print("Credentials not available")
-            return(1)
-        
+            for s3_key in stale_key_lst:
+                print('{}: deleted stale object: {} from bucket: {}'.format(
+                      cur_ts, s3_key['Key'], s3_bucket_nm))
+
+
+class S3MultipartWriter(io.RawIOBase):
+    """
+    Writable file object streaming its content to an AWS S3 object. Each time
+    part_size bytes are buffered they are sent as a part of a multipart upload,
+    so only one part is held in memory and nothing is written to local disk.
+    close() completes the upload and abort() discards it; a file smaller than
+    one part is sent with a single PUT request.
+    """
+
+    def __init__(self, s3, s3_bucket_nm, s3_key, part_size):
+        """
+        Args:
+            (S3.Client) s3 - AWS S3 client
+            (str) s3_bucket_nm - AWS S3 bucket name
+            (str) s3_key - AWS S3 object key
+            (int) part_size - multipart upload part size in bytes
+        """
+
+        super().__init__()
+        self.s3 = s3
+        self.s3_bucket_nm = s3_bucket_nm
+        self.s3_key = s3_key
+        self.part_size = max(part_size, s3_min_part_size)
+        self.upload_id = None
+        self.part_lst = []
+        self.buf = bytearray()
+        self.pos = 0
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError('I/O operation on closed file')
+
+        data_len = memoryview(data).nbytes
+        self.buf += data
+        self.pos += data_len
+        while len(self.buf) >= self.part_size:
+            self.upload_part(self.buf[:self.part_size])
+            del self.buf[:self.part_size]
+
+        return data_len
+
+    def upload_part(self, part):
+        if self.upload_id is None:
+            self.upload_id = self.s3.create_multipart_upload(
+                Bucket=self.s3_bucket_nm, Key=self.s3_key)['UploadId']
+
+        part_nbr = len(self.part_lst) + 1
+        rsp = self.s3.upload_part(Bucket=self.s3_bucket_nm, Key=self.s3_key,
+                                  UploadId=self.upload_id, PartNumber=part_nbr,
+                                  Body=bytes(part))
+        self.part_lst.append({'PartNumber': part_nbr, 'ETag': rsp['ETag']})
+
+    def close(self):
+        if self.closed:
+            return
+
+        try:
+            if self.upload_id is None:
+                self.s3.put_object(Bucket=self.s3_bucket_nm, Key=self.s3_key,
+                                   Body=bytes(self.buf))
+            else:
+                if self.buf:
+                    self.upload_part(self.buf)
+                self.s3.complete_multipart_upload(
+                    Bucket=self.s3_bucket_nm, Key=self.s3_key,
+                    UploadId=self.upload_id,
+                    MultipartUpload={'Parts': self.part_lst})
+        except BaseException:
+            self.abort()
+            raise
+
+        self.buf = bytearray()
+        super().close()
+
+    def abort(self):
+        if self.closed:
+            return
+
+        if self.upload_id is not None:
+            self.s3.abort_multipart_upload(Bucket=self.s3_bucket_nm,
+                                           Key=self.s3_key,
+                                           UploadId=self.upload_id)
+        self.buf = bytearray()
+        super().close()
+
+    def __del__(self):
+        # never publish a partial object when the writer is not closed
+        if not self.closed:
+            self.abort()
+
+
+def upload_file_to_s3(s3, src_f_path, s3_bucket_nm, s3_key,
+                      transfer_cfg=None, extra_args=None, run_rpt=None):
+    """
+    Upload a data file to an AWS S3 bucket, recording the upload as a step of
+    the run report, if any, with its wall time and bytes.
+
+    Args:
+        (S3.Client) s3 - AWS S3 client
+        (str) src_f_path - source file path
+        (str) s3_bucket_nm - AWS S3 bucket name
+        (str) s3_key - AWS S3 object key
+        (TransferConfig) transfer_cfg - multipart transfer settings; the boto3
+                                        defaults are used when not given
+        (dict) extra_args - extra object arguments such as the metadata
+        (RunReport) run_rpt - run report recording the upload
+
+    Returns:
+        (int) sts_cd - status code: 1 (error) or 0 (success)
+    """
+
+    start_ts = dt.datetime.now()
+    cur_ts = start_ts.strftime("%Y-%m-%d %H:%M:%S")
+    print('{}: uploading: {} to AWS S3'.format(cur_ts, src_f_path))
+    try:
+        s3.upload_file(src_f_path, s3_bucket_nm, s3_key,
+                       ExtraArgs=extra_args, Config=transfer_cfg)
+        cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        print('{}: uploaded: {} to AWS S3'.format(cur_ts, src_f_path))
+        sts_cd, err_msg = 0, None
+    except (FileNotFoundError, ClientError, S3UploadFailedError) as err:
+        cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        print('{}: failed while uploading file: {} to AWS S3'.\
+            format(cur_ts, src_f_path))
+        sts_cd, err_msg = 1, '{}: {}'.format(type(err).__name__, err)
+    except NoCredentialsError:
+        print("Credentials not available")
+        sts_cd, err_msg = 1, 'Credentials not available'
+    except BotoCoreError as err:
+        # e.g. the endpoint could not be reached or the connection timed out
+        cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        print('{}: failed while uploading file: {} to AWS S3'.\
+            format(cur_ts, src_f_path))
+        sts_cd, err_msg = 1, '{}: {}'.format(type(err).__name__, err)
+
+    if run_rpt is not None:
+        byte_cnt = os.path.getsize(src_f_path) if sts_cd == 0 else None
+        run_rpt.add_step('upload', s3_key,
+                         (dt.datetime.now() - start_ts).total_seconds(),
+                         byte_cnt=byte_cnt,
+                         sts='success' if sts_cd == 0 else 'error',
+                         err_msg=err_msg, start_ts=start_ts)
+
+    return(sts_cd)
+
+
+def write_copy_manifest(s3, manifest_url, s3_bucket_nm):
+    """
+    Write a Redshift COPY manifest listing every object of an AWS S3 bucket,
+    with its content length so that Redshift can plan the parallel reads. The
+    manifest covers the objects of earlier runs as well, since a full load
+    stages every month; a bucket without objects keeps the last manifest
+    rather than replacing it by one loading nothing.
+
+    Args:
+        (S3.Client) s3 - AWS S3 client
+        (str) manifest_url - AWS S3 URL of the manifest file
+        (str) s3_bucket_nm - AWS S3 bucket name of the objects
+    """
+
+    s3_obj_dict = list_s3_objects(s3, s3_bucket_nm)
+    if not s3_obj_dict:
+        cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        print('{}: no objects in bucket: {}; keeping COPY manifest: {}'.format(
+              cur_ts, s3_bucket_nm, manifest_url))
+        return
+
+    manifest = {'entries': [{'url': 's3://{}/{}'.format(s3_bucket_nm, s3_key)
+                             , 'mandatory': True
+                             , 'meta': {'content_length': s3_obj['size']}}
+                            for s3_key, s3_obj in sorted(s3_obj_dict.items())]}
+
+    s3_manifest_bucket_nm, s3_key = split_s3_url(manifest_url)
+    s3.put_object(Bucket=s3_manifest_bucket_nm, Key=s3_key,
+                  Body=json.dumps(manifest, indent=2).encode('utf-8'))
+
+    cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print('{}: wrote COPY manifest: {} listing {} objects'.format(
+          cur_ts, manifest_url, len(s3_obj_dict)))
+
+
+def upload_to_aws(s3, src_dir, s3_bucket_nm, upload_opt, manifest_url=None,
+                  run_rpt=None):
+    """
+    Upload data files with a directory to AWS S3. The files are spread across
+    a pool of upload threads and each file is sent in multipart chunks. In
+    fail fast mode the files not yet started are cancelled after the first
+    failed upload; otherwise every file is tried and the failures reported.
+    In sync mode only the files that are new or changed since they were last
+    uploaded are sent, with their SHA-256 hash stored in the object metadata.
+    Once every file is uploaded, the objects left by earlier uploads of the
+    same files, e.g. before the number of file parts changed, are deleted.
+    When every file is uploaded, a COPY manifest listing every object of the
+    bucket is written to the manifest URL, if any.
+
+    Args:
+        (S3.Client) s3 - AWS S3 client
+        (str) src_dir - source file directory
+        (str) s3_bucket_nm - AWS S3 bucket name
+        (dict) upload_opt - upload options returned by get_upload_opt()
+        (str) manifest_url - AWS S3 URL of the COPY manifest to write
+        (RunReport) run_rpt - run report recording each file uploaded
+
+    Returns:
+        (int) sts_cd - status code: 1 (error) or 0 (success)
+    """
+
+    transfer_cfg = get_transfer_config(upload_opt)
+
+    # Obtain the list of data files, skipping hidden files such as the
+    # cleaning manifest
+    src_f_lst = [src_f_nm for src_f_nm in os.listdir(src_dir)
+                 if not src_f_nm.startswith('.')]
+
+    # the objects of every local file are current, even those skipped by sync
+    cur_key_lst = [get_s3_key(src_f_nm, upload_opt['key_layout'])
+                   for src_f_nm in src_f_lst]
+
+    # in sync mode skip the files whose objects are unchanged
+    extra_args = {src_f_nm: None for src_f_nm in src_f_lst}
+    if upload_opt['sync']:
+        chg_f_dict = get_changed_files(s3, src_dir, src_f_lst, s3_bucket_nm,
+                                       upload_opt, transfer_cfg)
+        src_f_lst = list(chg_f_dict)
+        extra_args = {src_f_nm: {'Metadata': {'sha256': sha256}}
+                      for src_f_nm, sha256 in chg_f_dict.items()}
+
+    s3_key_dict = {src_f_nm: get_s3_key(src_f_nm, upload_opt['key_layout'])
+                   for src_f_nm in src_f_lst}
+
+    start_ts = dt.datetime.now()
+    up_obj_lst, byte_cnt, failed_f_lst = [], 0, []
+    with ThreadPoolExecutor(max_workers=upload_opt['upload_workers']) \
+            as executor:
+        futures = {executor.submit(upload_file_to_s3, s3,
+                                   src_dir + '/' + src_f_nm, s3_bucket_nm,
+                                   s3_key_dict[src_f_nm], transfer_cfg,
+                                   extra_args[src_f_nm], run_rpt): src_f_nm
+                   for src_f_nm in src_f_lst}
+        for future in as_completed(futures):
+            src_f_nm = futures[future]
+            if future.cancelled():
+                continue
+
+            if future.result() == 0:
+                f_size = os.path.getsize(src_dir + '/' + src_f_nm)
+                up_obj_lst.append(('s3://{}/{}'.format(s3_bucket_nm,
+                                                       s3_key_dict[src_f_nm]),
+                                   f_size))
+                byte_cnt += f_size
+                continue
+
+            failed_f_lst.append(src_f_nm)
+            if upload_opt['fail_fast']:
+                for pending in futures:
+                    pending.cancel()
+
+    elapsed_sec = max((dt.datetime.now() - start_ts).total_seconds(), 1e-6)
+    cur_ts = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print('{}: uploaded {} of {} files ({:.1f} MB) to bucket: {} in {:.1f} '
+          'seconds: {:.1f} MB/s'.format(cur_ts,
+          len(up_obj_lst), len(src_f_lst),
+          byte_cnt / 2**20, s3_bucket_nm, elapsed_sec,
+          byte_cnt / 2**20 / elapsed_sec))
+    for src_f_nm in failed_f_lst:
+        print('Error: failed to upload file: {}'.format(src_f_nm))
+
+    if failed_f_lst:
+        return(1)
+
+    delete_stale_s3_objects(s3, s3_bucket_nm, cur_key_lst)
+    if manifest_url:
+        write_copy_manifest(s3, manifest_url, s3_bucket_nm)
+
     return(0)
 
 
+def get_imgrtn_upload_dir(config):
+    """
+    Obtain the local directory and AWS S3 bucket of the cleaned immigration
+    data files; pre-aggregated files are kept in their own directory and bucket.
+
+    Args:
+        (ConfigParser) config - parsed data warehouse configuration file
+
+    Returns:
+        (tuple) imgrtn_data_loc_dir, s3_bucket_nm - local directory and bucket
+    """
+
+    if config.getboolean('CLEAN', 'pre_agg', fallback=False):
+        return (config['SRC_DATA']['imgrtn_agg_loc_dir'],
+                config['S3']['s3_imgrtn_agg_data_bucket'])
+
+    return (config['SRC_DATA']['imgrtn_data_loc_dir'],
+            config['S3']['s3_imgrtn_data_bucket'])
+
+
+def get_imgrtn_manifest_url(config):
+    """
+    Obtain the AWS S3 URL of the COPY manifest of the cleaned immigration data
+    files, kept in the misc data bucket away from the immigration objects.
+
+    Args:
+        (ConfigParser) config - parsed data warehouse configuration file
+
+    Returns:
+        (str) manifest_url - AWS S3 URL of the COPY manifest
+    """
+
+    if config.getboolean('CLEAN', 'pre_agg', fallback=False):
+        return config['S3']['s3_imgrtn_agg_manifest']
+
+    return config['S3']['s3_imgrtn_manifest']
+
+
 def main():
     """
     Parse data warehouse configuration file and call functions to upload local
@@ -50,25 +682,29 @@ def main():
     config = configparser.ConfigParser()
     config.read('dwh.cfg')  # windows configuration file
     
-    aws_access_key = config['AWS_KEY']['ACCESS_KEY']
-    aws_secret_key = config['AWS_KEY']['SECRET_KEY']
+    # a single client is shared by the misc and immigration uploads
+    upload_opt = get_upload_opt(config)
+    s3 = open_s3_client(upload_opt)
+    run_rpt = RunReport('upload_file_to_aws')
 
     # upload misc data files to AWS S3 bucket
     misc_data_loc_dir = config['SRC_DATA']['misc_data_loc_dir']
     s3_bucket_nm = config['S3']['s3_misc_data_bucket']
-    sts_cd = upload_to_aws(aws_access_key, aws_secret_key, misc_data_loc_dir
-                            , s3_bucket_nm)
-    if sts_cd == 1:
+    misc_sts_cd = upload_to_aws(s3, misc_data_loc_dir, s3_bucket_nm,
+                                upload_opt, run_rpt=run_rpt)
+    if misc_sts_cd == 1 and upload_opt['fail_fast']:
+        write_run_report(run_rpt, config, 1)
         exit(1)
     
     # upload immigration data files to AWS S3 bucket
-    imgrtn_data_loc_dir = config['SRC_DATA']['imgrtn_data_loc_dir']
-    s3_bucket_nm = config['S3']['s3_imgrtn_data_bucket']
-    uploaded = upload_to_aws(aws_access_key, aws_secret_key, imgrtn_data_loc_dir
-                                , s3_bucket_nm)
-    if sts_cd == 1:
+    imgrtn_data_loc_dir, s3_bucket_nm = get_imgrtn_upload_dir(config)
+    sts_cd = upload_to_aws(s3, imgrtn_data_loc_dir, s3_bucket_nm, upload_opt,
+                           get_imgrtn_manifest_url(config), run_rpt)
+    if sts_cd == 1 or misc_sts_cd == 1:
+        write_run_report(run_rpt, config, 1)
         exit(1)
     
+    write_run_report(run_rpt, config, 0)
     exit(0)
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()